@@ -1,12 +1,17 @@
 
+import csv
 import os
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 
-import urllib.parse
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import and_, bindparam, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 import ingest.models as models
+from ingest.dbengine import get_engine
 
 # from ingest.models import Base, StateData
 # from ingest.models import CaseSummaryFile, CasesByCounty, CasesByOnsetdate, CasesByAHD
@@ -15,12 +20,24 @@ import ingest.models as models
 # from ingest.models import CumulativeCasesByReported, CumulativeHospsByReported, CumulativeDeathsByReported
 
 
-def pop_column(row):
-	startquote = row.find('"')
-	endquote = row.find('"', startquote + 1)
-	return row[startquote+1:endquote], row[endquote+2:]
-
-# Managing inconsistent date format
+# One data row of a case summary file, with the attribute already parsed for date keyed sections
+# and NA/N/A values already mapped to None
+CaseRecord = namedtuple('CaseRecord', ['description', 'attribute', 'metric', 'value'])
+
+DATE_SECTIONS = {
+	'Case Counts by Onset Date',
+	'Case Counts by Reported Date',
+	'Positivity Data from Clinical Laboratories',
+	'Cumulative Number of Cases by Onset Date',
+	'Cumulative Number of Hospitalizations by Onset Date',
+	'Cumulative Number of Deaths by Onset Date',
+	'Cumulative Number of Cases by Reported Date',
+	'Cumulative Number of Hospitalizations by Reported Date',
+	'Cumulative Number of Deaths by Reported Date'
+}
+
+# Managing inconsistent date format.  The same few hundred dates repeat in every file.
+@lru_cache(maxsize=4096)
 def extract_date(value):
 	try:
 		return datetime.strptime(value, '%Y-%m-%d')
@@ -33,30 +50,30 @@ def checkfornull(value):
 		return None
 	return value
 
-def extract_quoted(input):
-	output = []
-	thischar = input.pop(0)
-	while thischar != '"' and len(input):
-		output.append(thischar)
-		thischar = input.pop(0)
-	return "".join(output)
-
-def split_cvs_string(input):
-	input = list(input)
-	output = []
-	latest = []
-	while len(input) > 0:
-		onechar = input.pop(0)
-		if onechar == '"':
-			latest = extract_quoted(input)
-			continue
-		if onechar == ',':
-			output.append("".join(latest))
-			latest = []
+# Fields of one line, quotes removed and the line ending stripped off the last one
+def split_fields(fields):
+	fields[-1] = fields[-1].strip()
+	return fields
+
+def make_record(fields):
+	description, attribute, metric, value = fields[:4]
+	if description in DATE_SECTIONS:
+		attribute = extract_date(attribute)
+	return CaseRecord(description, attribute, metric, checkfornull(value.strip()))
+
+def parse_line(oneline):
+	fields = split_fields(next(csv.reader([oneline])))
+	if fields[0] == 'description':
+		return None
+	return make_record(fields)
+
+# Streams the records of an open case summary file, skipping the header and the Note lines
+def read_records(fp):
+	for fields in csv.reader(oneline for oneline in fp if ",Note," not in oneline):
+		fields = split_fields(fields)
+		if fields[0] == 'description':
 			continue
-		latest.append(onechar)
-	output.append("".join(latest).strip())
-	return output
+		yield make_record(fields)
 
 def parse_reportfilename(filename):
 	fname, extension = filename.split('.')
@@ -67,324 +84,350 @@ def parse_reportfilename(filename):
 	return reportdate
 
 
-def get_sql_url(dbspec):
-	if dbspec['ENGINE'] == 'mssql':
-		return f"mssql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
-	elif dbspec['ENGINE'] == 'mysql':
-		constr = f"mysql+pymysql://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['HOST']}/{dbspec['DATABASE']}"
-		print(f"Connection string: {constr}")
-		return constr
-	# sooooo many problems with odbc
-#		return f"mysql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
-
-
-class CovidDatastore:
-	def __init__(self, dbspec):
-		self.engine = create_engine(get_sql_url(dbspec))
-
-		models.Base.metadata.create_all(self.engine)
-		self.DBSession = sessionmaker(bind=self.engine)
-		self.session = self.DBSession()
-		self.reportdate = None
-
+# Turns the lines of one case summary file into (model, values) pairs, one handler per section.
+# It holds no database state, so files can be parsed in other processes.
+class CaseSummaryParser:
+	def __init__(self, reportdate=None):
+		self.reportdate = reportdate
 		self.handlers = dict()
 		self.assign_handlers()
 
 	def assign_handlers(self):
-		self.handlers['State Data'] = self.insert_state_data
-		self.handlers['Case Counts by County'] = self.insert_cases_by_county
-		self.handlers['Case Counts by Age Group'] = self.insert_cases_by_agegrp
-		self.handlers['Case Counts by Sex'] = self.insert_cases_by_sex
-		self.handlers['COVID-19 in Colorado by Sex'] = self.insert_cases_by_sex
-		self.handlers['Fatal cases by sex'] = self.insert_deaths_by_sex
-		self.handlers['Case Counts by Onset Date'] = self.insert_case_counts_by_onset
-		self.handlers['Case Counts by Reported Date'] = self.insert_case_counts_by_reported
-		self.handlers['Deaths'] = self.insert_deaths_by_county
-		self.handlers['Case Counts by Age Group, Hospitalizations, and Deaths'] = self.insert_case_counts_by_ahd
-		self.handlers['Case Counts by Age Group, Hospitalizations'] = self.insert_case_counts_by_ahd
-		self.handlers['Cumulative Number of Cases by Onset Date'] = self.insert_cum_cases_by_onset
-		self.handlers['Cumulative Number of Hospitalizations by Onset Date'] = self.insert_cum_hosp_by_onset
-		self.handlers['Cumulative Number of Deaths by Onset Date'] = self.insert_cum_deaths_by_onset
-		self.handlers['Cumulative Number of Cases by Reported Date'] = self.insert_cum_cases_by_reported
-		self.handlers['Cumulative Number of Hospitalizations by Reported Date'] = self.insert_cum_hosps_by_reported
-		self.handlers['Cumulative Number of Deaths by Reported Date'] = self.insert_cum_deaths_by_reported
-		self.handlers['Transmission Type'] = self.insert_transmission_type
-		self.handlers['Positivity Data from Clinical Laboratories'] = self.insert_positivity_data
-
-	def is_loaded(self, filename):
-		fileset = self.session.query(models.CaseSummaryFile).filter(models.CaseSummaryFile.filename==filename).first()
-		if fileset is None:
-			return False
-		if fileset.state != 'loaded':
-			return False
-		return True
-
-	def mark_loaded(self, filename):
-		filerecord = self.session.query(models.CaseSummaryFile).filter(models.CaseSummaryFile.filename==filename).first()
-		if filerecord is None:
-			reportdate = parse_reportfilename(filename)
-			if reportdate is None:
-				return
-			filesize = os.path.getsize(f'data/{filename}')
-			filerecord = models.CaseSummaryFile(
-					filename = filename,
-					size = filesize,
-					state = 'loaded',
-					released = reportdate)
-		else:
-			filerecord.state = 'loaded'
-
-		self.session.add(filerecord)
-		self.session.commit()
-
-
-	def load(self, filename):
-		fname, extension = filename.split('.')
-		if extension != 'csv':
-			print(f"Skipping {filename}")
-			return
-		print(f"Processing {filename}")
-		covid19, case, summary, reportdate = fname.split('_')
-		self.reportdate = datetime.strptime(reportdate, '%Y-%m-%d')
+		self.handlers['State Data'] = self.parse_state_data
+		self.handlers['Case Counts by County'] = self.parse_cases_by_county
+		self.handlers['Case Counts by Age Group'] = self.parse_cases_by_agegrp
+		self.handlers['Case Counts by Sex'] = self.parse_cases_by_sex
+		self.handlers['COVID-19 in Colorado by Sex'] = self.parse_cases_by_sex
+		self.handlers['Fatal cases by sex'] = self.parse_deaths_by_sex
+		self.handlers['Case Counts by Onset Date'] = self.parse_case_counts_by_onset
+		self.handlers['Case Counts by Reported Date'] = self.parse_case_counts_by_reported
+		self.handlers['Deaths'] = self.parse_deaths_by_county
+		self.handlers['Case Counts by Age Group, Hospitalizations, and Deaths'] = self.parse_case_counts_by_ahd
+		self.handlers['Case Counts by Age Group, Hospitalizations'] = self.parse_case_counts_by_ahd
+		self.handlers['Cumulative Number of Cases by Onset Date'] = self.parse_cum_cases_by_onset
+		self.handlers['Cumulative Number of Hospitalizations by Onset Date'] = self.parse_cum_hosp_by_onset
+		self.handlers['Cumulative Number of Deaths by Onset Date'] = self.parse_cum_deaths_by_onset
+		self.handlers['Cumulative Number of Cases by Reported Date'] = self.parse_cum_cases_by_reported
+		self.handlers['Cumulative Number of Hospitalizations by Reported Date'] = self.parse_cum_hosps_by_reported
+		self.handlers['Cumulative Number of Deaths by Reported Date'] = self.parse_cum_deaths_by_reported
+		self.handlers['Transmission Type'] = self.parse_transmission_type
+		self.handlers['Positivity Data from Clinical Laboratories'] = self.parse_positivity_data
+
+	# Parsed rows of one file, grouped by the table they go to
+	def read_batches(self, filename):
+		batches = dict()
 		with open(f"data/{filename}") as fp:
-			for oneline in fp:
-				if ",Note," in oneline:
-					continue
-				self.insert(oneline)
-		self.mark_loaded(filename)
-
-
-	def insert(self, oneline):
-		row = split_cvs_string(oneline)
-		if row[0] == 'description':
-			return
+			for record in read_records(fp):
+				model, values = self.parse_record(record)
+				batches.setdefault(model, []).append(values)
+		return batches
+
+	def parse(self, oneline):
+		record = parse_line(oneline)
+		if record is None:
+			return None
+		return self.parse_record(record)
+
+	def parse_record(self, record):
 		try:
-			self.handlers[row[0]](row)
+			return self.handlers[record.description](record)
 		except (ValueError, KeyError) as ve:
-			print(f"Value error on {oneline}")
+			print(f"Value error on {record}")
 			raise ve
 
-	def insert_state_data(self, row):
-		_ = row.pop(0)
-		_ = row.pop(0)
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.StateData(summaryfiledate=self.reportdate, itemname=key, itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
+	def parse_state_data(self, record):
+		key = record.metric
+		value = record.value
+		return models.StateData, dict(summaryfiledate=self.reportdate, itemname=key, itemvalue=value)
 
 
-	def insert_cases_by_county(self, row):
-		_ = row.pop(0)
-		countyname = row.pop(0)
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.CasesByCounty(
+	def parse_cases_by_county(self, record):
+		countyname = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CasesByCounty, dict(
 			summaryfiledate=self.reportdate,
 			county=countyname,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cases_by_agegrp(self, row):
-		_ = row.pop(0)
-		agegroup = row.pop(0)
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.CasesByAgeGroup(
+	def parse_cases_by_agegrp(self, record):
+		agegroup = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CasesByAgeGroup, dict(
 			summaryfiledate=self.reportdate,
 			agegroup=agegroup,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cases_by_sex(self, row):
-		_ = row.pop(0)
-		sex = row.pop(0)
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CasesBySex(
+	def parse_cases_by_sex(self, record):
+		sex = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CasesBySex, dict(
 			summaryfiledate=self.reportdate,
 			sex=sex,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_deaths_by_sex(self, row):
-		_ = row.pop(0)
-		sex = row.pop(0)
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.DeathsBySex(
+	def parse_deaths_by_sex(self, record):
+		sex = record.attribute
+		key = record.metric
+		value = record.value
+		return models.DeathsBySex, dict(
 			summaryfiledate=self.reportdate,
 			sex=sex,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_case_counts_by_onset(self, row):
-		_ = row.pop(0)
-		onsetdate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.CasesByOnsetdate(
+	def parse_case_counts_by_onset(self, record):
+		onsetdate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CasesByOnsetdate, dict(
 			summaryfiledate=self.reportdate,
 			onsetdate=onsetdate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_deaths_by_county(self, row):
-		_ = row.pop(0)
-		county = row.pop(0)
-		key = row.pop(0)
-		value = row.pop(0).strip()
+	def parse_deaths_by_county(self, record):
+		county = record.attribute
+		key = record.metric
+		value = record.value
 
-		insertable = models.DeathsByCounty(
+		return models.DeathsByCounty, dict(
 			summaryfiledate=self.reportdate,
 			county=county,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_case_counts_by_ahd(self, row):
-		_ = row.pop(0)
-		age_and_hosp = row.pop(0)
-		cases = row.pop(0)
+	def parse_case_counts_by_ahd(self, record):
+		age_and_hosp = record.attribute
+		cases = record.metric
 		if cases != 'Cases':
 			raise ValueError("cases is not Cases")
-		value = row.pop(0).strip()
+		value = record.value
 		agegroup, hospitalization = age_and_hosp.split(',')
 		hospitalization = hospitalization.strip()
 
-		insertable = models.CasesByAHD(
+		return models.CasesByAHD, dict(
 			summaryfiledate=self.reportdate,
 			agegroup=agegroup,
 			hospitalization=hospitalization,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_case_counts_by_reported(self, row):
-		_ = row.pop(0)
-		reporteddate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.CasesByReported(
+	def parse_case_counts_by_reported(self, record):
+		reporteddate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CasesByReported, dict(
 			summaryfiledate=self.reportdate,
 			reporteddate=reporteddate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_positivity_data(self, row):
-		_ = row.pop(0)
-		testdate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
+	def parse_positivity_data(self, record):
+		testdate = record.attribute
+		key = record.metric
+		value = record.value
 
-		insertable = models.PositivityData(
+		return models.PositivityData, dict(
 			summaryfiledate=self.reportdate,
 			testdate=testdate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_cases_by_onset(self, row):
-		_ = row.pop(0)
-		onsetdate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = checkfornull(row.pop(0).strip())
-		insertable = models.CumulativeCasesByOnsetdate(
+	def parse_cum_cases_by_onset(self, record):
+		onsetdate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeCasesByOnsetdate, dict(
 			summaryfiledate=self.reportdate,
 			onsetdate=onsetdate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_hosp_by_onset(self, row):
-		_ = row.pop(0)
-		onsetdate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CumulativeHospByOnsetdate(
+	def parse_cum_hosp_by_onset(self, record):
+		onsetdate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeHospByOnsetdate, dict(
 			summaryfiledate=self.reportdate,
 			onsetdate=onsetdate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_deaths_by_onset(self, row):
-		_ = row.pop(0)
-		onsetdate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CumulativeDeathByOnsetdate(
+	def parse_cum_deaths_by_onset(self, record):
+		onsetdate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeDeathByOnsetdate, dict(
 			summaryfiledate=self.reportdate,
 			onsetdate=onsetdate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_cases_by_reported(self, row):
-		_ = row.pop(0)
-		reporteddate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CumulativeCasesByReported(
+	def parse_cum_cases_by_reported(self, record):
+		reporteddate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeCasesByReported, dict(
 			summaryfiledate=self.reportdate,
 			reporteddate=reporteddate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_hosps_by_reported(self, row):
-		_ = row.pop(0)
-		reporteddate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CumulativeHospsByReported(
+	def parse_cum_hosps_by_reported(self, record):
+		reporteddate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeHospsByReported, dict(
 			summaryfiledate=self.reportdate,
 			reporteddate=reporteddate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_cum_deaths_by_reported(self, row):
-		_ = row.pop(0)
-		reporteddate = extract_date(row.pop(0))
-		key = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.CumulativeDeathsByReported(
+	def parse_cum_deaths_by_reported(self, record):
+		reporteddate = record.attribute
+		key = record.metric
+		value = record.value
+		return models.CumulativeDeathsByReported, dict(
 			summaryfiledate=self.reportdate,
 			reporteddate=reporteddate,
 			itemname=key,
 			itemvalue=value)
-		self.session.add(insertable)
-		self.session.commit()
 
-	def insert_transmission_type(self, row):
-		_ = row.pop(0)
-		transtype = row.pop(0)
-		measure = row.pop(0)
-		value = row.pop(0).strip()
-		insertable = models.TransmissionType(
+	def parse_transmission_type(self, record):
+		transtype = record.attribute
+		measure = record.metric
+		value = record.value
+		return models.TransmissionType, dict(
 			summaryfiledate=self.reportdate,
 			transtype=transtype,
 			itemmeasure=measure,
 			itemvalue=value)
-		self.session.add(insertable)
+
+
+# Inserts rows, replacing the values of any already stored under the same natural key, so loading a
+# file twice leaves one copy.  sqlite and mysql upsert in the statement itself, other engines delete
+# the matching rows first within the same transaction.
+def upsert_rows(session, model, rows):
+	key = models.natural_key(model)
+	values = [name for name in rows[0] if name not in key]
+	dialect = session.get_bind().dialect.name
+	if dialect == 'sqlite':
+		statement = sqlite_insert(model)
+		statement = statement.on_conflict_do_update(
+			index_elements=key,
+			set_={name: statement.excluded[name] for name in values})
+	elif dialect == 'mysql':
+		statement = mysql_insert(model)
+		statement = statement.on_duplicate_key_update({name: statement.inserted[name] for name in values})
+	else:
+		table = model.__table__
+		matching = and_(*(table.c[name] == bindparam(name) for name in key))
+		session.connection().execute(table.delete().where(matching), rows)
+		statement = insert(model)
+	session.execute(statement, rows)
+
+
+# Parses one file in a worker process, the batches come back to be written by the caller
+def parse_file(filename):
+	return filename, CaseSummaryParser(parse_reportfilename(filename)).read_batches(filename)
+
+
+# pool_size bounds the connections the engine holds open, one per writer when loading in parallel
+class CovidDatastore:
+	def __init__(self, dbspec, pool_size=5):
+		self.engine = get_engine(dbspec, pool_size=pool_size, max_overflow=0)
+
+		models.Base.metadata.create_all(self.engine)
+		self.DBSession = sessionmaker(bind=self.engine)
+		self.session = self.DBSession()
+		self.parser = CaseSummaryParser()
+
+	def is_loaded(self, filename):
+		fileset = self.session.query(models.CaseSummaryFile).filter(models.CaseSummaryFile.filename==filename).first()
+		if fileset is None:
+			return False
+		if fileset.state != 'loaded':
+			return False
+		return True
+
+	# Names of every file already loaded, in one query
+	def loaded_files(self):
+		rows = self.session.query(models.CaseSummaryFile.filename).filter(models.CaseSummaryFile.state=='loaded')
+		return {filename for filename, in rows}
+
+	# Adds or updates the file's record in the session's current transaction, the caller commits
+	def record_loaded(self, filename, session=None):
+		session = self.session if session is None else session
+		filerecord = session.query(models.CaseSummaryFile).filter(models.CaseSummaryFile.filename==filename).first()
+		if filerecord is None:
+			reportdate = parse_reportfilename(filename)
+			if reportdate is None:
+				return
+			filesize = os.path.getsize(f'data/{filename}')
+			filerecord = models.CaseSummaryFile(
+					filename = filename,
+					size = filesize,
+					state = 'loaded',
+					released = reportdate)
+		else:
+			filerecord.state = 'loaded'
+
+		session.add(filerecord)
+
+	def mark_loaded(self, filename):
+		self.record_loaded(filename)
+		self.session.commit()
+
+
+	# With bulk set, the whole file is parsed into per-table batches first and written in one
+	# transaction together with its summaryfile record, so a failed load leaves nothing behind.
+	# Otherwise every row is committed as it is read.
+	def load(self, filename, bulk=True):
+		fname, extension = filename.split('.')
+		if extension != 'csv':
+			print(f"Skipping {filename}")
+			return
+		print(f"Processing {filename}")
+		covid19, case, summary, reportdate = fname.split('_')
+		self.parser.reportdate = datetime.strptime(reportdate, '%Y-%m-%d')
+		if not bulk:
+			with open(f"data/{filename}") as fp:
+				for oneline in fp:
+					if ",Note," in oneline:
+						continue
+					self.insert(oneline)
+			self.mark_loaded(filename)
+			return
+
+		self.store_batches(filename, self.parser.read_batches(filename))
+
+	# Writes one file's batches and its summaryfile record as a single transaction.  Parallel writers
+	# pass their own session, the shared one is used otherwise.
+	def store_batches(self, filename, batches, session=None):
+		session = self.session if session is None else session
+		try:
+			self.write_batches(batches, session)
+			self.record_loaded(filename, session)
+			session.commit()
+		except Exception:
+			session.rollback()
+			raise
+
+	# One executemany upsert per table, inside the session's open transaction
+	def write_batches(self, batches, session=None):
+		session = self.session if session is None else session
+		for model, rows in batches.items():
+			upsert_rows(session, model, rows)
+
+	def insert(self, oneline):
+		parsed = self.parser.parse(oneline)
+		if parsed is None:
+			return
+		model, values = parsed
+		upsert_rows(self.session, model, [values])
 		self.session.commit()
@@ -0,0 +1,47 @@
+import urllib.parse
+
+from sqlalchemy import create_engine, event
+
+# Applied to every new sqlite connection.  WAL lets readers keep querying while a load writes, and
+# with it synchronous=NORMAL only syncs at checkpoints, which is what makes bulk loads fast.  The busy
+# timeout makes parallel writers queue for the write lock instead of failing.
+SQLITE_PRAGMAS = {
+	'journal_mode': 'WAL',
+	'synchronous': 'NORMAL',
+	'temp_store': 'MEMORY',
+	'cache_size': -65536,
+	'mmap_size': 268435456,
+	'busy_timeout': 60000
+}
+
+
+def get_sql_url(dbspec):
+	if dbspec['ENGINE'] == 'mssql':
+		return f"mssql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
+	elif dbspec['ENGINE'] == 'mysql':
+		constr = f"mysql+pymysql://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['HOST']}/{dbspec['DATABASE']}"
+		print(f"Connection string: {constr}")
+		return constr
+	elif dbspec['ENGINE'] == 'sqlite':
+		# DATABASE is the path of the database file
+		return f"sqlite:///{dbspec['DATABASE']}"
+	# sooooo many problems with odbc
+#		return f"mysql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
+	raise ValueError(f"Unknown database engine {dbspec['ENGINE']}")
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+	cursor = dbapi_connection.cursor()
+	for name, value in SQLITE_PRAGMAS.items():
+		cursor.execute(f"PRAGMA {name}={value}")
+	cursor.close()
+
+
+# Engine for a dbservers entry.  sqlite has no schemas, so the models' coviddata schema is
+# translated away and every table lives in the one database file.
+def get_engine(dbspec, **kwargs):
+	engine = create_engine(get_sql_url(dbspec), **kwargs)
+	if dbspec['ENGINE'] != 'sqlite':
+		return engine
+	event.listen(engine, 'connect', set_sqlite_pragmas)
+	return engine.execution_options(schema_translate_map={"coviddata": None})
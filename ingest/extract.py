@@ -1,26 +1,14 @@
-import urllib.parse
 from datetime import datetime
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
 
 import ingest.models as models
+from ingest.dbengine import get_engine
 from utils.hoconfig import HoConfig
 
 
-def get_sql_url(dbspec):
-	if dbspec['ENGINE'] == 'mssql':
-		return f"mssql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
-	elif dbspec['ENGINE'] == 'mysql':
-		constr = f"mysql+pymysql://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['HOST']}/{dbspec['DATABASE']}"
-		print(f"Connection string: {constr}")
-		return constr
-	# sooooo many problems with odbc
-#		return f"mysql+pyodbc://{dbspec['USER']}:{urllib.parse.quote(dbspec['PASSWORD'])}@{dbspec['DSN']}"
-
-
 def extract_case_counts_by_reported():
 	config = HoConfig('/etc/dh/epi.conf')
-	engine = create_engine(get_sql_url(config.dbservers['LOCAL']))
+	engine = get_engine(config.dbservers['LOCAL'])
 
 	models.Base.metadata.create_all(engine)
 	DBSession = sessionmaker(bind=engine)
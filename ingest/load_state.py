@@ -1,23 +1,114 @@
-
-
+import argparse
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
 from os import listdir
 from os.path import isfile, join
+from threading import Thread
 
-from ingest.coviddatastore import CovidDatastore
+from ingest.coviddatastore import CovidDatastore, parse_file
+from parts.querunner import ARNOLD, Terminator
 from utils.hoconfig import HoConfig
 
 
+# Writes parsed files through its own session, one transaction per file.  After an error it keeps
+# draining the queue so the parsing side never blocks on a dead writer.
+class BatchWriter(Thread):
+	def __init__(self, datastore, pending):
+		Thread.__init__(self, daemon=True)
+		self.datastore = datastore
+		self.pending = pending
+		self.written = 0
+		self.error = None
+
+	def run(self):
+		session = self.datastore.DBSession()
+		try:
+			while True:
+				entity = self.pending.get()
+				if isinstance(entity, Terminator):
+					return
+				if self.error is not None:
+					continue
+				filename, batches = entity
+				try:
+					self.datastore.store_batches(filename, batches, session)
+					self.written += 1
+				except Exception as err:
+					print(f"Error when processing file {filename}")
+					self.error = err
+		finally:
+			session.close()
+
+
+# Case summary files in the directory that haven't been loaded yet, found with a single query
+def pending_files(datastore, directory='data'):
+	loaded = datastore.loaded_files()
+	filelist = [f for f in listdir(directory) if isfile(join(directory, f))]
+	for filename in filelist:
+		if not filename.endswith('.csv'):
+			print(f"Skipping {filename}")
+	return sorted(f for f in filelist if f.endswith('.csv') and f not in loaded)
+
+
+# Files are parsed across worker processes and their batches handed to writer threads through a
+# bounded queue, so parsing runs at most backlog files ahead of the database.
+def load_parallel(datastore, filenames, workers=None, writers=4, backlog=16):
+	pending = queue.Queue(maxsize=backlog)
+	threads = [BatchWriter(datastore, pending) for _ in range(0, writers)]
+	for thread in threads:
+		thread.start()
+	try:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			for filename, batches in executor.map(parse_file, filenames):
+				print(f"Processing {filename}")
+				pending.put((filename, batches))
+				if any(thread.error is not None for thread in threads):
+					executor.shutdown(cancel_futures=True)
+					break
+	finally:
+		for thread in threads:
+			pending.put(ARNOLD)
+		for thread in threads:
+			thread.join()
+	for thread in threads:
+		if thread.error is not None:
+			raise thread.error
+	return sum(thread.written for thread in threads)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Load new case summary files into the database")
+	parser.add_argument('--workers', type=int, default=os.cpu_count(), metavar='N',
+	                    help="Parse files across N worker processes")
+	parser.add_argument('--writers', type=int, default=4, metavar='N',
+	                    help="Write parsed files over N connections at once")
+	parser.add_argument('--server', default='TEST', metavar='NAME',
+	                    help="dbservers entry to load into, its ENGINE may be mssql, mysql or sqlite")
+	parser.add_argument('--serial', action='store_true',
+	                    help="Load one file at a time through a single session")
+	return parser.parse_args()
+
+
 def main():
+	args = parse_args()
 	config = HoConfig('/etc/dh/epi.conf')
-	datastore = CovidDatastore(config.dbservers['TEST'])
-	filelist = [f for f in listdir('data') if isfile(join('data', f))]
-	for filename in filelist:
-		if not datastore.is_loaded(filename):
+	# One connection per writer plus the one the main session holds
+	datastore = CovidDatastore(config.dbservers[args.server], pool_size=args.writers + 1)
+	filelist = pending_files(datastore)
+	started = time.time()
+	if args.serial:
+		for filename in filelist:
 			try:
 				datastore.load(filename)
 			except Exception as exp:
 				print(f"Error when processing file {filename}")
 				raise exp
+		loaded = len(filelist)
+	else:
+		loaded = load_parallel(datastore, filelist, args.workers, args.writers)
+	print(f"{loaded} files loaded in {time.time() - started:.1f}s")
 
 
 
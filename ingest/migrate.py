@@ -0,0 +1,47 @@
+import argparse
+
+from sqlalchemy import delete, func, select
+
+import ingest.models as models
+from ingest.dbengine import get_engine
+from utils.hoconfig import HoConfig
+
+
+# Drops all but the newest row (highest id) of every natural key, the one the last load of a
+# reloaded file wrote.  The ids to keep go through a derived table, mysql won't delete from a table
+# its own subquery reads.
+def dedup_table(connection, model):
+	table = model.__table__
+	key = [table.c[name] for name in models.natural_key(model)]
+	keep = select(func.max(table.c.id).label('id')).group_by(*key).subquery('keep')
+	result = connection.execute(delete(table).where(table.c.id.not_in(select(keep.c.id))))
+	return result.rowcount
+
+
+# Brings a database created before the tables had indexes up to date.  Duplicates have to go first
+# or the unique indexes can't be built.  Runs in one transaction where the engine supports
+# transactional DDL, and is safe to run again.
+def migrate(engine):
+	with engine.begin() as connection:
+		for model in models.data_models():
+			removed = dedup_table(connection, model)
+			for index in sorted(model.__table__.indexes, key=lambda index: index.name):
+				index.create(connection, checkfirst=True)
+			print(f"{model.__tablename__}: {removed} duplicate rows removed")
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Deduplicate the coviddata tables and add their indexes")
+	parser.add_argument('--server', default='TEST', metavar='NAME',
+	                    help="dbservers entry to migrate")
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	config = HoConfig('/etc/dh/epi.conf')
+	migrate(get_engine(config.dbservers[args.server]))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,6 @@
 
 
-from sqlalchemy import Column, Integer, String, DateTime, Float
+from sqlalchemy import Column, Integer, String, DateTime, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -17,7 +17,9 @@ class CaseSummaryFile(Base):
 
 class StateData(Base):
 	__tablename__ = 'statedata'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_statedata', 'summaryfiledate', 'itemname', unique=True),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -26,7 +28,10 @@ class StateData(Base):
 
 class CasesByCounty(Base):
 	__tablename__ = 'CasesByCounty'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbycounty', 'summaryfiledate', 'county', 'itemname', unique=True),
+		Index('ix_casesbycounty_county', 'county'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -36,7 +41,10 @@ class CasesByCounty(Base):
 
 class CasesByAgeGroup(Base):
 	__tablename__ = 'CasesByAgeGroup'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbyagegroup', 'summaryfiledate', 'agegroup', 'itemname', unique=True),
+		Index('ix_casesbyagegroup_agegroup', 'agegroup'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -46,7 +54,10 @@ class CasesByAgeGroup(Base):
 
 class CasesBySex(Base):
 	__tablename__ = 'CasesBySex'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbysex', 'summaryfiledate', 'sex', 'itemname', unique=True),
+		Index('ix_casesbysex_sex', 'sex'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -56,7 +67,10 @@ class CasesBySex(Base):
 
 class DeathsBySex(Base):
 	__tablename__ = 'DeathsBySex'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_deathsbysex', 'summaryfiledate', 'sex', 'itemname', unique=True),
+		Index('ix_deathsbysex_sex', 'sex'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -66,7 +80,10 @@ class DeathsBySex(Base):
 
 class CasesByOnsetdate(Base):
 	__tablename__ = 'CasesByOnsetdate'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbyonsetdate', 'summaryfiledate', 'onsetdate', 'itemname', unique=True),
+		Index('ix_casesbyonsetdate_onsetdate', 'onsetdate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -76,7 +93,10 @@ class CasesByOnsetdate(Base):
 
 class CasesByReported(Base):
 	__tablename__ = 'CasesByReported'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbyreported', 'summaryfiledate', 'reporteddate', 'itemname', unique=True),
+		Index('ix_casesbyreported_reporteddate', 'reporteddate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -86,7 +106,10 @@ class CasesByReported(Base):
 
 class DeathsByCounty(Base):
 	__tablename__ = 'DeathsByCounty'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_deathsbycounty', 'summaryfiledate', 'county', 'itemname', unique=True),
+		Index('ix_deathsbycounty_county', 'county'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -96,7 +119,10 @@ class DeathsByCounty(Base):
 
 class CasesByAHD(Base):
 	__tablename__ = 'CasesByAHD'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_casesbyahd', 'summaryfiledate', 'agegroup', 'hospitalization', unique=True),
+		Index('ix_casesbyahd_agegroup', 'agegroup'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -106,7 +132,10 @@ class CasesByAHD(Base):
 
 class PositivityData(Base):
 	__tablename__ = 'PositivityData'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_positivitydata', 'summaryfiledate', 'testdate', 'itemname', unique=True),
+		Index('ix_positivitydata_testdate', 'testdate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -116,7 +145,10 @@ class PositivityData(Base):
 
 class CumulativeCasesByOnsetdate(Base):
 	__tablename__ = 'CumulativeCasesByOnsetdate'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativecasesbyonsetdate', 'summaryfiledate', 'onsetdate', 'itemname', unique=True),
+		Index('ix_cumulativecasesbyonsetdate_onsetdate', 'onsetdate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -126,7 +158,10 @@ class CumulativeCasesByOnsetdate(Base):
 
 class CumulativeHospByOnsetdate(Base):
 	__tablename__ = 'CumulativeHospByOnsetdate'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativehospbyonsetdate', 'summaryfiledate', 'onsetdate', 'itemname', unique=True),
+		Index('ix_cumulativehospbyonsetdate_onsetdate', 'onsetdate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -136,7 +171,10 @@ class CumulativeHospByOnsetdate(Base):
 
 class CumulativeDeathByOnsetdate(Base):
 	__tablename__ = 'CumulativeDeathByOnsetdate'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativedeathbyonsetdate', 'summaryfiledate', 'onsetdate', 'itemname', unique=True),
+		Index('ix_cumulativedeathbyonsetdate_onsetdate', 'onsetdate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -146,7 +184,10 @@ class CumulativeDeathByOnsetdate(Base):
 
 class CumulativeCasesByReported(Base):
 	__tablename__ = 'CumulativeCasesByReported'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativecasesbyreported', 'summaryfiledate', 'reporteddate', 'itemname', unique=True),
+		Index('ix_cumulativecasesbyreported_reporteddate', 'reporteddate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -156,7 +197,10 @@ class CumulativeCasesByReported(Base):
 
 class CumulativeHospsByReported(Base):
 	__tablename__ = 'CumulativeHospsByReported'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativehospsbyreported', 'summaryfiledate', 'reporteddate', 'itemname', unique=True),
+		Index('ix_cumulativehospsbyreported_reporteddate', 'reporteddate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -166,7 +210,10 @@ class CumulativeHospsByReported(Base):
 
 class CumulativeDeathsByReported(Base):
 	__tablename__ = 'CumulativeDeathsByReported'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_cumulativedeathsbyreported', 'summaryfiledate', 'reporteddate', 'itemname', unique=True),
+		Index('ix_cumulativedeathsbyreported_reporteddate', 'reporteddate'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -176,7 +223,10 @@ class CumulativeDeathsByReported(Base):
 
 class TransmissionType(Base):
 	__tablename__ = 'TransmissionType'
-	__table_args__ = {"schema": "coviddata"}
+	__table_args__ = (
+		Index('uq_transmissiontype', 'summaryfiledate', 'transtype', 'itemmeasure', unique=True),
+		Index('ix_transmissiontype_transtype', 'transtype'),
+		{"schema": "coviddata"})
 
 	id = Column(Integer, nullable=False, unique=True, primary_key=True)
 	summaryfiledate = Column(DateTime, nullable=False)
@@ -185,5 +235,16 @@ class TransmissionType(Base):
 	itemvalue = Column(Float, nullable=True)
 
 
+# Every data table has a unique uq_ index on the columns that identify one value in one summary file.
+# Loads upsert on it, so reloading a file replaces its values instead of duplicating them.
+def natural_key(model):
+	for index in model.__table__.indexes:
+		if index.unique and index.name.startswith('uq_'):
+			return [column.name for column in index.columns]
+	return None
 
 
+# The tables loaded from case summary files, everything but the summaryfile bookkeeping
+def data_models():
+	models = [mapper.class_ for mapper in Base.registry.mappers if natural_key(mapper.class_) is not None]
+	return sorted(models, key=lambda model: model.__tablename__)
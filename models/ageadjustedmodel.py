@@ -3,15 +3,18 @@ import numpy as np
 
 from parts.amortizedmarkov import ProbState
 from parts.agegrouprates import SubgroupRates
+from parts.compiledmarkov import compile_seir_model
 from parts.hospitalized_agegroup import AgeGroup
 from parts.constants import *
-from models.basic_math import calc_beta
+from models.basic_math import calc_beta, calc_beta_schedule
 
 
 # Like SEIR, but moves 15% of the "recovered" into the hospital for an average length hospital stay
 # https://en.wikipedia.org/wiki/Compartmental_models_in_epidemiology
 class AgeAdjustedModel:
-	def __init__(self):
+	def __init__(self, compiled=False):
+		self.compiled = compiled
+		self.engine = None
 		self.r0 = 2.65
 		self.total_days = 0
 		self.population = POP_DENVER
@@ -30,7 +33,7 @@ class AgeAdjustedModel:
 
 		self.subgroups = dict()
 		for key, value in AGE_DISTRIBUTION.items():
-			self.subgroups[key] = AgeGroup(SubgroupRates(ICD[key], value), name=key)
+			self.subgroups[key] = AgeGroup(SubgroupRates(ICD_PROJECTION[key], value), name=key)
 
 		self.sum_isolated = None
 		self.sum_noncrit = None
@@ -68,7 +71,7 @@ class AgeAdjustedModel:
 
 		self.subgroups = dict()
 		for key, value in AGE_DISTRIBUTION.items():
-			self.subgroups[key] = AgeGroup(SubgroupRates(ICD[key], value), name=key)
+			self.subgroups[key] = AgeGroup(SubgroupRates(ICD_PROJECTION[key], value), name=key)
 
 	def set_r0(self, value):
 		self.r0 = value
@@ -83,15 +86,30 @@ class AgeAdjustedModel:
 
 	def run_r0_set(self, date_offsets, r0_values):
 		self.reset()
+		if self.compiled:
+			self.run_compiled(date_offsets, r0_values)
+			return
 
 		day_counter = 0
 		for itr in range(0, len(date_offsets)):
 			self.set_r0(r0_values[itr])
-			self.beta = calc_beta(self.r0, self.dayspergen)
+			self.beta = calc_beta(self.r0, self.infectious.period)
 			while day_counter < date_offsets[itr]:
 				self.step_day()
 				day_counter += 1
 
+	def run_compiled(self, date_offsets, r0_values):
+		# reset() rebuilds the age groups, so the graph has to be compiled after it
+		self.engine = compile_seir_model(self)
+		betas = calc_beta_schedule(date_offsets, r0_values, self.infectious.period)
+		self.set_r0(r0_values[-1])
+		self.beta = calc_beta(self.r0, self.infectious.period)
+
+		self.engine.load()
+		self.engine.run(betas)
+		self.engine.writeback()
+		self.total_days += len(betas)
+
 	def step_day(self):
 		new_infections = self.beta * self.susceptible.count * self.infectious.count / self.population
 #		print(f"Day {self.total_days}, {self.beta} * {self.susceptible.count} * {self.infectious.count} / {self.population} = {new_infections}")
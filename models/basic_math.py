@@ -8,3 +8,12 @@ def calc_infected(total_pop, beta, susceptible, infected):
 	base_infected = beta * infected
 	immunity_factor = susceptible / total_pop
 	return base_infected * immunity_factor
+
+# Per-day betas matching the stepping loop in run_r0_set: r0_values[itr] holds until date_offsets[itr]
+def calc_beta_schedule(date_offsets, r0_values, periods_infectious):
+	betas = []
+	for itr in range(0, len(date_offsets)):
+		beta = calc_beta(r0_values[itr], periods_infectious)
+		while len(betas) < date_offsets[itr]:
+			betas.append(beta)
+	return betas
@@ -3,6 +3,7 @@ import numpy as np
 
 from parts.agegrouprates import SubgroupRates
 from parts.hospitalized_agegroup import AgeGroup
+from parts.impulseresponse import ImpulseResponse
 from parts.constants import *
 import csv
 from datetime import datetime, timedelta
@@ -19,7 +20,7 @@ class ExternallyDrivenModel:
 
 		self.subgroups = dict()
 		for key, value in AGE_DISTRIBUTION.items():
-			self.subgroups[key] = AgeGroup(SubgroupRates(ICD[key], value), name=key)
+			self.subgroups[key] = AgeGroup(SubgroupRates(ICD_PROJECTION[key], value), name=key)
 
 		self.sum_isolated = None
 		self.sum_noncrit = None
@@ -70,7 +71,7 @@ class ExternallyDrivenModel:
 		self.total_days = 0
 		self.subgroups = dict()
 		for key, value in AGE_DISTRIBUTION.items():
-			self.subgroups[key] = AgeGroup(SubgroupRates(ICD[key], value), name=key)
+			self.subgroups[key] = AgeGroup(SubgroupRates(ICD_PROJECTION[key], value), name=key)
 
 	def set_population(self, value):
 		self.population = value
@@ -80,6 +81,15 @@ class ExternallyDrivenModel:
 		while len(self.daily_input) > 0:
 			self.step_day()
 
+	# Same curves as run(), but each age group's admissions go through one convolution
+	def run_convolved(self):
+		self.reset()
+		admissions = np.array(self.daily_input, dtype=float)
+		for itr, agegroup in enumerate(self.subgroups.values()):
+			ImpulseResponse(agegroup, len(admissions)).apply(admissions[:, itr])
+		self.total_days += len(admissions)
+		self.daily_input = []
+
 	def step_day(self):
 
 		todayset = self.daily_input.pop(0)
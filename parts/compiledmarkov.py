@@ -0,0 +1,121 @@
+import numpy as np
+from scipy import sparse
+
+from models.basic_math import calc_infected
+
+
+# Flattens a graph of ProbStates into a state vector and a sparse transition matrix, so that a day
+# of the amortized markov chain becomes one mat-vec plus the nonlinear infection term.
+#
+# Exit states pointing at a state outside of the compiled set are treated as leaving the model. This
+# mirrors groups that never step some of their states (AgeGroup never applies h_post_icu).
+class CompiledMarkov:
+	def __init__(self, states):
+		self.states = list(states)
+		self.size = len(self.states)
+		self.index = dict()
+		for itr, state in enumerate(self.states):
+			self.index[id(state)] = itr
+
+		self.passthroughs = dict()
+		self.infection = None
+		self.transition = None
+
+		self.state = None
+		self.history = None
+
+	def position(self, state):
+		return self.index[id(state)]
+
+	# Anything arriving in holding is also forwarded to targets on the same day.  The holding state
+	# itself never drains, so its count tallies everything that has passed through it.
+	def add_passthrough(self, holding, targets):
+		self.passthroughs[id(holding)] = [(self.position(state), fraction) for state, fraction in targets]
+
+	def set_infection(self, susceptible, incubating, infectious, population):
+		self.infection = (self.position(susceptible), self.position(incubating), self.position(infectious), float(population))
+
+	def compile(self):
+		rows = []
+		cols = []
+		vals = []
+		for src, state in enumerate(self.states):
+			if state.bedpool is not None:
+				raise ValueError(f"State {state.name} has a bed pool, capacity limits can't be compiled")
+			rows.append(src)
+			cols.append(src)
+			vals.append(1.0)
+			if id(state) in self.passthroughs:
+				continue
+			for exitstate in state.exit_states:
+				rows.append(src)
+				cols.append(src)
+				vals.append(-exitstate.probability)
+				if id(exitstate.target) not in self.index:
+					continue
+				rows.append(self.position(exitstate.target))
+				cols.append(src)
+				vals.append(exitstate.probability)
+				for target, fraction in self.passthroughs.get(id(exitstate.target), []):
+					rows.append(target)
+					cols.append(src)
+					vals.append(exitstate.probability * fraction)
+
+		self.transition = sparse.csr_matrix((vals, (rows, cols)), shape=(self.size, self.size))
+		return self
+
+	def initial_vector(self):
+		return np.array([state.count for state in self.states], dtype=float)
+
+	def load(self, vector=None):
+		if vector is None:
+			vector = self.initial_vector()
+		self.state = np.array(vector, dtype=float)
+		self.history = [self.state]
+
+	def step(self, beta):
+		current = self.state
+		upcoming = self.transition @ current
+		if self.infection is not None:
+			susceptible, incubating, infectious, population = self.infection
+			new_infections = calc_infected(population, beta, current[susceptible], current[infectious])
+			upcoming[susceptible] -= new_infections
+			upcoming[incubating] += new_infections
+		self.state = upcoming
+		self.history.append(upcoming)
+
+	def run(self, betas):
+		for beta in betas:
+			self.step(beta)
+
+	def get_history(self):
+		return np.vstack(self.history)
+
+	def get_domain(self, state):
+		return [day[self.position(state)] for day in self.history]
+
+	# Append the simulated days onto the ProbStates, as apply_pending would have, so the existing
+	# gather_sums code can be used
+	def writeback(self):
+		history = self.get_history()
+		for itr, state in enumerate(self.states):
+			if id(state) in self.passthroughs:
+				continue
+			state.domain.extend(history[1:, itr].tolist())
+			state.count = state.domain[-1]
+			state.pending = 0.0
+
+
+# Compiles the SEIR chain plus age groups shared by ScenarioDrivenModel, HospFloorModel and AgeAdjustedModel
+def compile_seir_model(model):
+	states = [model.susceptible, model.incubating, model.infectious, model.isolated_holding]
+	entries = []
+	for key, agegroup in model.subgroups.items():
+		states.extend(agegroup.get_states())
+		for state, fraction in agegroup.get_entry_states():
+			entries.append((state, fraction * agegroup.stats.pop_dist))
+
+	engine = CompiledMarkov(states)
+	engine.add_passthrough(model.isolated_holding, entries)
+	engine.set_infection(model.susceptible, model.incubating, model.infectious, model.population)
+	return engine.compile()
@@ -81,6 +81,19 @@ ICD = {
 	AGE8x: { 'hosp_rate': .273, 'crit_rate': .709, 'fatality': .093 }
 }
 
+# ICD in the age_projection form SubgroupRates takes, for the models that aren't driven by a scenario
+# file.  The ventilator and ICU death rates aren't in the Imperial data, these are the ones the
+# scenario files use.
+ICD_PROJECTION = {
+	key: {
+		'p_hospitalized': rates['hosp_rate'],
+		'p_noncrit': 1 - rates['crit_rate'],
+		'p_urgent_icu': rates['crit_rate'],
+		'p_icu_vent': .75,
+		'p_icu_death': .5
+	} for key, rates in ICD.items()
+}
+
 # 53 ventilators
 #
 #
@@ -38,6 +38,19 @@ class AgeGroup:
 		self.h_post_icu.normalize_states_over_period()
 
 
+	# States stepped each day, h_post_icu is not among them
+	def get_states(self):
+		return [self.isolated, self.h_noncrit, self.h_icu, self.h_icu_vent, self.recovered, self.deceased]
+
+	# Where apply_infections puts newly diagnosed cases, and in what proportion
+	def get_entry_states(self):
+		return [
+			(self.isolated,   self.stats.p_selfisolate),
+			(self.h_noncrit,  self.stats.p_nevercrit),
+			(self.h_icu,      self.stats.p_icu_nonvent),
+			(self.h_icu_vent, self.stats.p_icu_vent)
+		]
+
 	# Add N people to the list of infected
 	def apply_infections(self, infections):
 		inf_float = float(infections)
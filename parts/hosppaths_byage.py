@@ -60,6 +60,20 @@ class PathsByAge:
 		return retval
 
 
+	def get_states(self):
+		return [self.isolated, self.nevercrit, self.pre_icu, self.icu_novent, self.icu_vent, self.post_icu,
+		        self.recovered, self.deceased]
+
+	# Where apply_infections puts newly diagnosed cases, and in what proportion
+	def get_entry_states(self):
+		return [
+			(self.isolated,   self.stats.p_selfisolate),
+			(self.nevercrit,  self.stats.p_nevercrit),
+			(self.pre_icu,    self.stats.p_pre_icu),
+			(self.icu_vent,   self.stats.p_urgent_icu_vent),
+			(self.icu_novent, self.stats.p_urgent_icu_novent)
+		]
+
 	# Add N people to the list of infected
 	def apply_infections(self, infections):
 		inf_float = float(infections)
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy import signal
+
+from parts.compiledmarkov import CompiledMarkov
+
+
+# Once the daily diagnosed inflow is known, an age group's hospital side is linear.  This precomputes
+# the response of every state to a single diagnosed case, so a whole inflow series becomes one
+# convolution per state instead of a day by day walk over the ProbStates.
+#
+# The group passed in is only read for its structure, its states should still be empty.
+class ImpulseResponse:
+	def __init__(self, group, days=160):
+		self.group = group
+		self.states = group.get_states()
+		self.engine = CompiledMarkov(self.states).compile()
+
+		self.entry = np.zeros(self.engine.size)
+		for state, fraction in group.get_entry_states():
+			self.entry[self.engine.position(state)] += fraction
+		self.kernels = None
+		self.extend(days)
+
+	# kernels[k] holds every state k days after one case was diagnosed.  Each pass doubles the kernel
+	# by applying the transition matrix raised to the current length, so n days take log2(n) products.
+	def extend(self, days):
+		if self.kernels is not None and len(self.kernels) >= days:
+			return
+		power = self.engine.transition.toarray()
+		kernels = self.entry[np.newaxis, :]
+		while len(kernels) < days:
+			kernels = np.vstack([kernels, kernels @ power.T])
+			power = power @ power
+		self.kernels = kernels[:days]
+
+	# Curves for each state, laid out like ProbState.domain: the initial 0 followed by one value per day
+	def respond(self, inflow):
+		inflow = np.asarray(inflow, dtype=float)
+		days = len(inflow)
+		self.extend(days)
+		curves = np.zeros((days + 1, self.engine.size))
+		curves[1:] = signal.fftconvolve(inflow[:, np.newaxis], self.kernels[:days], axes=0)[:days]
+		return curves
+
+	# Extends the group's ProbState domains as if the inflow had been stepped through apply_infections
+	def apply(self, inflow):
+		curves = self.respond(inflow)
+		for itr, state in enumerate(self.states):
+			state.domain.extend(curves[1:, itr].tolist())
+			state.count = state.domain[-1]
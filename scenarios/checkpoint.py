@@ -0,0 +1,73 @@
+import json
+import os
+
+import numpy as np
+
+
+# GA state between generations, kept as a compressed npz.  The population is the next generation
+# still to be scored, parents and fitness are the generation it was bred from, and the RNG and
+# convergence monitor state are stored as JSON so a resumed run draws exactly the same numbers.
+# The shift dates record which r0 each genome column belongs to, for warm starts against a newer seed.
+# A surrogate's training set is kept too when there is one, so a resumed run screens the same candidates.
+def save_checkpoint(path, generation, population, parents, fitness, rng, monitor_state, base_key, shift_dates,
+                    surrogate_state=None):
+	surrogate = dict()
+	if surrogate_state is not None:
+		surrogate = {'surrogate_points': surrogate_state['points'], 'surrogate_values': surrogate_state['values']}
+	tmpname = f"{path}.tmp"
+	with open(tmpname, 'wb') as fp:
+		np.savez_compressed(fp,
+		                    generation=np.array(generation),
+		                    population=population,
+		                    parents=parents,
+		                    fitness=fitness,
+		                    rng_state=np.array(json.dumps(rng.bit_generator.state)),
+		                    rng_seed=np.array(json.dumps(seed_state(rng))),
+		                    monitor_state=np.array(json.dumps(monitor_state)),
+		                    base_key=np.array(base_key),
+		                    shift_dates=np.array(shift_dates, dtype=str),
+		                    **surrogate)
+	# Written to a temporary file first so an interrupted save never replaces a good checkpoint
+	os.replace(tmpname, path)
+
+
+def load_checkpoint(path):
+	with np.load(path) as stored:
+		checkpoint = {
+			'generation': int(stored['generation']),
+			'population': stored['population'],
+			'parents': stored['parents'],
+			'fitness': stored['fitness'],
+			'rng_state': json.loads(str(stored['rng_state'])),
+			'rng_seed': json.loads(str(stored['rng_seed'])) if 'rng_seed' in stored.files else None,
+			'monitor_state': json.loads(str(stored['monitor_state'])),
+			'base_key': str(stored['base_key']),
+			'shift_dates': [str(shiftdate) for shiftdate in stored['shift_dates']],
+			'surrogate_state': None
+		}
+		if 'surrogate_points' in stored.files:
+			checkpoint['surrogate_state'] = {'points': stored['surrogate_points'], 'values': stored['surrogate_values']}
+	return checkpoint
+
+
+# scipy's qmc samplers draw from children spawned off the generator's SeedSequence rather than from
+# the generator itself, so the sequence and its spawn count are saved alongside the generator state
+def seed_state(rng):
+	seed_seq = rng.bit_generator.seed_seq
+	return {
+		'entropy': seed_seq.entropy,
+		'spawn_key': list(seed_seq.spawn_key),
+		'pool_size': seed_seq.pool_size,
+		'n_children_spawned': seed_seq.n_children_spawned
+	}
+
+
+def restore_rng(rng_state, rng_seed=None):
+	seed_seq = None
+	if rng_seed is not None:
+		seed_seq = np.random.SeedSequence(rng_seed['entropy'], spawn_key=tuple(rng_seed['spawn_key']),
+		                                  pool_size=rng_seed['pool_size'],
+		                                  n_children_spawned=rng_seed['n_children_spawned'])
+	rng = np.random.default_rng(seed_seq)
+	rng.bit_generator.state = rng_state
+	return rng
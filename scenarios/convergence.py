@@ -0,0 +1,90 @@
+import json
+import time
+
+import numpy as np
+
+
+# Tracks a GA run generation by generation and decides when it's done: the best and median fitness
+# both going `patience` generations without improving by more than min_delta, the wall clock passing
+# max_seconds, or the best fitness reaching target.  A criterion left at None is never checked.
+class ConvergenceMonitor:
+	def __init__(self, spans, patience=None, max_seconds=None, target=None, min_delta=0.0, history_path=None):
+		self.spans = np.asarray(spans, dtype=float)
+		self.patience = patience
+		self.max_seconds = max_seconds
+		self.target = target
+		self.min_delta = min_delta
+		self.history_path = history_path
+
+		self.started = time.time()
+		self.last_record = self.started
+		self.best = np.inf
+		self.median = np.inf
+		self.stale = 0
+		self.evaluations = 0
+		self.records = []
+
+	# Diversity is the mean standard deviation of each gene, as a share of that gene's search range
+	def diversity(self, population):
+		return float(np.mean(np.std(population, axis=0) / self.spans))
+
+	def record(self, generation, population, fitness, evaluations):
+		now = time.time()
+		finite = fitness[np.isfinite(fitness)]
+		best = float(finite.min()) if len(finite) else np.inf
+		median = float(np.median(finite)) if len(finite) else np.inf
+
+		improved = False
+		if best < self.best - self.min_delta:
+			self.best = best
+			improved = True
+		if median < self.median - self.min_delta:
+			self.median = median
+			improved = True
+		self.stale = 0 if improved else self.stale + 1
+		self.evaluations += evaluations
+
+		summary = {
+			'generation': generation,
+			'best': best,
+			'median': median,
+			'diversity': self.diversity(population),
+			'evaluations': evaluations,
+			'total_evaluations': self.evaluations,
+			'seconds': now - self.last_record,
+			'elapsed': now - self.started
+		}
+		self.last_record = now
+		self.records.append(summary)
+		if self.history_path is not None:
+			with open(self.history_path, 'a') as fp:
+				fp.write(json.dumps(summary) + '\n')
+		return summary
+
+	# Everything needed to carry on judging convergence in a resumed run
+	def state(self):
+		return {
+			'best': self.best,
+			'median': self.median,
+			'stale': self.stale,
+			'evaluations': self.evaluations,
+			'elapsed': time.time() - self.started
+		}
+
+	def restore(self, state):
+		self.best = state['best']
+		self.median = state['median']
+		self.stale = state['stale']
+		self.evaluations = state['evaluations']
+		self.started = time.time() - state['elapsed']
+		self.last_record = time.time()
+
+	# The reason to stop after the latest record, or None to keep going
+	def stop_reason(self):
+		if self.target is not None and self.best <= self.target:
+			return f"reached target fitness {self.target}"
+		if self.patience is not None and self.stale >= self.patience:
+			return f"no improvement in {self.patience} generations"
+		if self.max_seconds is not None and time.time() - self.started >= self.max_seconds:
+			return f"used the {self.max_seconds}s budget"
+		return None
@@ -0,0 +1,256 @@
+import numpy as np
+
+from models.basic_math import calc_infected
+from scenarios.fitset import DaySeries
+from scenarios.scenariodriven import ScenarioDrivenModel
+
+# Parameters that shape the transition matrix, every member of an ensemble has to agree on them
+STRUCTURAL_PARAMETERS = ['incubation_period', 'prediagnosis_period', 'age_distribution', 'age_projection']
+
+
+# Per-row betas: day d of candidate c runs at the first r0 whose offset is still ahead of d, exactly
+# as run_r0_set walks its shifts.  Days past a candidate's last offset get a beta of 0.
+def beta_matrix(date_offsets, r0_values, period, days):
+	ahead = date_offsets[:, :, np.newaxis] > np.arange(days)[np.newaxis, np.newaxis, :]
+	current = np.argmax(ahead, axis=1)
+	betas = np.take_along_axis(r0_values, current, axis=1) / period
+	betas[~ahead.any(axis=1)] = 0.0
+	return betas
+
+
+# Pads ragged r0 schedules into (candidates x shifts) arrays.  Padding repeats the final offset, and
+# since the day loop never reaches it again the padded r0 values are never used.
+def pad_schedules(offset_lists, r0_lists):
+	width = max(len(offsets) for offsets in offset_lists)
+	date_offsets = np.zeros((len(offset_lists), width), dtype=int)
+	r0_values = np.zeros((len(offset_lists), width))
+	for row, (offsets, r0s) in enumerate(zip(offset_lists, r0_lists)):
+		date_offsets[row, :len(offsets)] = offsets
+		date_offsets[row, len(offsets):] = offsets[-1]
+		r0_values[row, :len(r0s)] = r0s
+		r0_values[row, len(r0s):] = r0s[-1]
+	return date_offsets, r0_values
+
+
+# Groups identical rows of a (rows x fields) array.  Returns the first row of each group and every
+# row's group number, as np.unique(axis=0) does but without its slow sort over whole rows.
+def group_rows(keys):
+	order = np.lexsort(keys.T[::-1])
+	ordered = keys[order]
+	leading = np.ones(len(keys), dtype=bool)
+	leading[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+	groups = np.empty(len(keys), dtype=int)
+	groups[order] = np.cumsum(leading) - 1
+	return order[leading], groups
+
+
+# The compiled ScenarioDrivenModel graph, stepped for many candidates at once as a
+# (candidates x compartments) array.  Every candidate shares the template's structure.
+class BatchedModel:
+	def __init__(self, scenario):
+		self.template = ScenarioDrivenModel(scenario, compiled=True)
+		self.engine = self.template.engine
+		self.transition_t = self.engine.transition.T.tocsr()
+		self.period = self.template.infectious.period
+
+		self.pos_susceptible = self.engine.position(self.template.susceptible)
+		self.pos_incubating = self.engine.position(self.template.incubating)
+		self.pos_infectious = self.engine.position(self.template.infectious)
+		self.pos_diagnosed = self.engine.position(self.template.isolated_holding)
+
+		agegroups = list(self.template.subgroups.values())
+		self.pos_isolated = [self.engine.position(group.isolated) for group in agegroups]
+		self.pos_noncrit = [self.engine.position(group.h_noncrit) for group in agegroups]
+		self.pos_icu = [self.engine.position(group.h_icu) for group in agegroups]
+		self.pos_icu_vent = [self.engine.position(group.h_icu_vent) for group in agegroups]
+		self.pos_recovered = [self.engine.position(group.recovered) for group in agegroups]
+		self.pos_deceased = [self.engine.position(group.deceased) for group in agegroups]
+
+	def initial_states(self, count):
+		return np.tile(self.engine.initial_vector(), (count, 1))
+
+	def step_day(self, states, betas, population):
+		upcoming = states @ self.transition_t
+		new_infections = calc_infected(population, betas, states[:, self.pos_susceptible], states[:, self.pos_infectious])
+		upcoming[:, self.pos_susceptible] -= new_infections
+		upcoming[:, self.pos_incubating] += new_infections
+		return upcoming
+
+	# Returns the (days + 1, candidates, compartments) history, running until the furthest offset
+	def run(self, date_offsets, r0_values, initial_states, population):
+		days = int(date_offsets.max())
+		betas = beta_matrix(date_offsets, r0_values, self.period, days)
+		history = np.empty((days + 1, len(initial_states), self.engine.size))
+		history[0] = initial_states
+		for day in range(0, days):
+			history[day + 1] = self.step_day(history[day], betas[:, day], population)
+		return history
+
+	# Cumulative diagnosed per day, lined up like hospital_door_aggregator
+	def total_hosp(self, history):
+		return history[1:, :, self.pos_diagnosed]
+
+	def total_deceased(self, history):
+		return history[:, :, self.pos_deceased].sum(axis=2)
+
+
+# EpiScenario.calculate_fit for a whole population.  total_hosp and total_deceased are (days x candidates)
+# series, and observed_offsets holds the model day each candidate's first observed date falls on.
+# Candidates whose run doesn't cover the observations score inf rather than raising.
+def batch_fitness(total_hosp, total_deceased, total_days, r0_values, observed, observed_offsets):
+	actual_hosp = observed['hospitalized']
+	actual_dead = observed['deceased']
+	present = ~np.isnan(actual_hosp)
+	days = np.arange(observed.days)[present]
+
+	index = days[:, np.newaxis] + observed_offsets[np.newaxis, :]
+	valid = (index.min(axis=0) >= 0) & (index.max(axis=0) < total_days)
+	index = np.clip(index, 0, len(total_hosp) - 1)
+
+	model_hosp = np.take_along_axis(total_hosp, index, axis=0)
+	model_dead = np.take_along_axis(total_deceased, index, axis=0)
+	hosp_r2 = np.sum((model_hosp - actual_hosp[present][:, np.newaxis]) ** 2, axis=0)
+	dead_r2 = np.sum((model_dead - actual_dead[present][:, np.newaxis]) ** 2, axis=0)
+	hosp_avg = np.sum(actual_hosp[present]) / len(days)
+	dead_avg = np.sum(actual_dead[present]) / len(days)
+
+	# Prefer models where R1 doesn't vary wildly
+	previous = np.hstack([np.full((len(r0_values), 1), 3.0), r0_values[:, :-1]])
+	r2_hold = np.sqrt(np.sum((previous - r0_values) ** 2, axis=1))
+
+	fitness = np.sqrt(hosp_r2) / hosp_avg + np.sqrt(dead_r2) / dead_avg + r2_hold / 3
+	fitness[~valid] = np.inf
+	return fitness
+
+
+# Runs a population of ScenarioDrivenModel scenarios in lockstep, with each candidate on its own
+# initial date and r0 schedule, and hands the results back to the scenarios.  With share_prefixes set
+# the ensemble is run one r0 segment at a time instead, see run_prefixes.
+class EnsembleRunner:
+	def __init__(self, scenarios, share_prefixes=False):
+		self.scenarios = list(scenarios)
+		self.share_prefixes = share_prefixes
+		first = self.scenarios[0].parameters
+		for scenario in self.scenarios[1:]:
+			for key in STRUCTURAL_PARAMETERS:
+				if scenario.parameters.get(key) != first.get(key):
+					raise ValueError(f"Scenario {scenario.serial} differs from the ensemble on {key}")
+
+		self.model = BatchedModel(self.scenarios[0])
+		self.population = np.array([scenario.totalpop for scenario in self.scenarios], dtype=float)
+		self.date_offsets, self.r0_values = pad_schedules(
+			[scenario.r0_date_offsets for scenario in self.scenarios],
+			[scenario.r0_values for scenario in self.scenarios])
+		self.total_days = self.date_offsets.max(axis=1)
+		self.history = None
+		self.days_simulated = 0
+		self.segments = 0
+		self.shared_segments = 0
+
+	def initial_states(self):
+		model = self.model
+		states = model.initial_states(len(self.scenarios))
+		for row, scenario in enumerate(self.scenarios):
+			states[row, model.pos_susceptible] = scenario.init_susceptible
+			states[row, model.pos_incubating] = scenario.init_infected
+			states[row, model.pos_infectious] = scenario.init_infectious
+		return states
+
+	def run(self):
+		if self.share_prefixes:
+			self.run_prefixes()
+			return
+		self.history = self.model.run(self.date_offsets, self.r0_values, self.initial_states(), self.population)
+		self.days_simulated = int(self.total_days.sum())
+
+	# The state on a segment's last day depends on nothing but the population, the starting
+	# compartments and the (end day, r0) of every segment up to it.  Candidates that agree on all of
+	# that, such as a sweep over a late shift's r0, reach the same state, so each distinct prefix is
+	# simulated once and its days copied to every candidate sharing it.  A prefix is tracked by an id,
+	# a segment's id standing for its parent's id plus its own end day and r0.  Days past a
+	# candidate's own last day are left unset, gather_sums never reads them.
+	def run_prefixes(self):
+		model = self.model
+		count = len(self.scenarios)
+		self.history = np.empty((int(self.total_days.max()) + 1, count, model.engine.size))
+		states = self.initial_states()
+		self.history[0] = states
+		_, prefix = group_rows(np.column_stack([self.population, states]))
+		next_id = int(prefix.max()) + 1
+		starts = np.zeros(count, dtype=int)
+		self.days_simulated = 0
+		self.segments = 0
+		self.shared_segments = 0
+
+		for column in range(0, self.date_offsets.shape[1]):
+			ends = np.maximum(starts, np.minimum(self.date_offsets[:, column], self.total_days))
+			active = np.flatnonzero(ends > starts)
+			if len(active) == 0:
+				continue
+			keys = np.column_stack([prefix[active], ends[active], self.r0_values[active, column]])
+			first, shared = group_rows(keys)
+			leaders = active[first]
+			lengths = ends[leaders] - starts[leaders]
+			segment = model.run(lengths[:, np.newaxis], self.r0_values[leaders, column][:, np.newaxis],
+			                    self.history[starts[leaders], leaders], self.population[leaders])
+
+			# Candidates with the same first and last day take their days from their leaders in one copy
+			firsts, spans = group_rows(np.column_stack([starts[active], ends[active]]))
+			for span, row in enumerate(active[firsts]):
+				within = spans == span
+				start = int(starts[row])
+				end = int(ends[row])
+				self.history[start + 1:end + 1, active[within]] = segment[1:end - start + 1, shared[within]]
+
+			prefix[active] = next_id + shared
+			next_id += len(leaders)
+			self.days_simulated += int(lengths.sum())
+			self.segments += len(active)
+			self.shared_segments += len(active) - len(leaders)
+			starts = ends
+
+	# How much simulating shared prefixes once saved, against every candidate running every day
+	def report(self):
+		lockstep = int(self.total_days.sum())
+		return {
+			'segments': self.segments,
+			'shared_segments': self.shared_segments,
+			'hit_rate': self.shared_segments / self.segments if self.segments else 0.0,
+			'days_simulated': self.days_simulated,
+			'days_saved': lockstep - self.days_simulated
+		}
+
+	# Fills each scenario with the same outputs ScenarioDrivenModel.gather_sums would
+	def gather_sums(self):
+		model = self.model
+		for row, scenario in enumerate(self.scenarios):
+			days = int(self.total_days[row])
+			curves = self.history[:days + 1, row, :]
+
+			scenario.out_susceptible = curves[:, model.pos_susceptible].tolist()
+			scenario.out_incubating = curves[:, model.pos_incubating].tolist()
+			scenario.out_infectious = curves[:, model.pos_infectious].tolist()
+			scenario.sum_isolated  = curves[:, model.pos_isolated].sum(axis=1)
+			scenario.sum_noncrit   = curves[:, model.pos_noncrit].sum(axis=1)
+			scenario.sum_icu       = curves[:, model.pos_icu].sum(axis=1)
+			scenario.sum_icu_vent  = curves[:, model.pos_icu_vent].sum(axis=1)
+			scenario.sum_recovered = curves[:, model.pos_recovered].sum(axis=1)
+			scenario.sum_deceased  = curves[:, model.pos_deceased].sum(axis=1)
+			scenario.sum_hospitalized = scenario.sum_icu + scenario.sum_noncrit + scenario.sum_icu_vent
+
+			diagnosed = curves[:, model.pos_diagnosed].tolist()
+			scenario.hospital_door_aggregator = diagnosed[1:]
+			scenario.hospital_door_aggregator.append(diagnosed[-1])
+
+			scenario.fitset = DaySeries(scenario.initial_date, {
+				'current_hosp': scenario.sum_hospitalized[:days],
+				'total_hosp': scenario.hospital_door_aggregator[:days],
+				'total_deceased': scenario.sum_deceased[:days]
+			})
+
+	def calculate_fit(self, ideal):
+		fitlist = []
+		for scenario in self.scenarios:
+			scenario.calculate_fit(ideal)
+			fitlist.append(scenario.fitness)
+		return fitlist
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+def canonical_hash(value):
+	return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+
+# Remembers the fitness of scenario parameters that have already been scored, so elites carried into
+# the next generation and repeated mutations aren't simulated again.  Keys also cover the ideal being
+# fitted, a cache file written against other actual data is ignored on load.
+class FitnessCache:
+	def __init__(self, ideal, maxsize=100000, path=None):
+		self.ideal_key = canonical_hash(sorted(ideal.items()))
+		self.maxsize = maxsize
+		self.path = path
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+		if path is not None and os.path.isfile(path):
+			with open(path, 'r') as fp:
+				stored = json.load(fp)
+			if stored.get('ideal') == self.ideal_key:
+				for key, fitness in stored['entries']:
+					self.entries[key] = fitness
+				self.trim()
+
+	def key(self, parameters):
+		return canonical_hash([self.ideal_key, parameters])
+
+	def get(self, parameters):
+		key = self.key(parameters)
+		fitness = self.entries.get(key)
+		if fitness is None:
+			self.misses += 1
+			return None
+		self.entries.move_to_end(key)
+		self.hits += 1
+		return fitness
+
+	def put(self, parameters, fitness):
+		key = self.key(parameters)
+		self.entries[key] = fitness
+		self.entries.move_to_end(key)
+		self.trim()
+
+	def trim(self):
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+	# Written to a temporary file first so an interrupted save never leaves a truncated cache behind
+	def save(self):
+		if self.path is None:
+			return
+		tmpname = f"{self.path}.tmp"
+		with open(tmpname, 'w') as fp:
+			json.dump({'ideal': self.ideal_key, 'entries': list(self.entries.items())}, fp)
+		os.replace(tmpname, self.path)
+
+	# Per-generation summary, the counters start over after each report
+	def report(self):
+		summary = {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+		self.hits = 0
+		self.misses = 0
+		return summary
@@ -1,6 +1,8 @@
 
 from datetime import datetime, timedelta
 
+import numpy as np
+
 # FIT_START = datetime(2020, 3, 9)
 # FIT_END = datetime(2020, 5, 2)
 # # HOSP_FIT = [38, 44, 58, 58, 72, 84, 148, 176, 239, 274]
@@ -36,6 +38,62 @@ COLORADO_ACTUAL = {
 
 
 ONEDAY = timedelta(1)
+
+
+# Named daily series sharing one integer day index, with day 0 falling on start
+class DaySeries:
+	def __init__(self, start, series):
+		self.start = start
+		self.series = dict()
+		for name, values in series.items():
+			self.series[name] = np.asarray(values, dtype=float)
+		self.days = len(next(iter(self.series.values())))
+
+	def __getitem__(self, name):
+		return self.series[name]
+
+	def offset(self, date):
+		return (date - self.start).days
+
+	# The values for days days from start, NaN wherever this series has nothing
+	def window(self, name, start, days):
+		output = np.full(days, np.nan)
+		shift = (self.start - start).days
+		low = max(shift, 0)
+		high = min(shift + self.days, days)
+		if low < high:
+			output[low:high] = self.series[name][low - shift:high - shift]
+		return output
+
+
+# Lines up a dict of observations keyed by date, like COLORADO_ACTUAL, as a DaySeries.  Dates with no
+# observation are NaN.  The last ALIGNED_MAX dicts converted are remembered, the cache holds on to them
+# so their ids stay theirs.  Callers handing the same observations to other processes should send the
+# DaySeries, a dict unpickled there is a new object every time.
+ALIGNED_MAX = 8
+ALIGNED = dict()
+
+def observed_series(actual):
+	if isinstance(actual, DaySeries):
+		return actual
+	if id(actual) in ALIGNED and ALIGNED[id(actual)][0] is actual:
+		return ALIGNED[id(actual)][1]
+
+	start = min(actual)
+	days = (max(actual) - start).days + 1
+	columns = dict()
+	for values in actual.values():
+		for name in values:
+			columns[name] = np.full(days, np.nan)
+	for date, values in actual.items():
+		for name, value in values.items():
+			columns[name][(date - start).days] = value
+
+	series = DaySeries(start, columns)
+	ALIGNED[id(actual)] = (actual, series)
+	while len(ALIGNED) > ALIGNED_MAX:
+		ALIGNED.pop(next(iter(ALIGNED)))
+	return series
 #
 # cursor = FIT_START
 # while cursor <= FIT_END:
@@ -1,137 +1,285 @@
 
-import json
-import math
-import random
-from datetime import datetime, timedelta
-from operator import attrgetter
-from scenarios.scenario import EpiScenario
-from scenarios.scenariodriven import ScenarioDrivenModel
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
 
-from scenarios.fitset import COLORADO_ACTUAL
+import numpy as np
+
+from scenarios.ensemble import EnsembleRunner
+from scenarios.fitnesscache import FitnessCache
+from scenarios.genome import GenomeSpace, SAMPLERS
+from scenarios.convergence import ConvergenceMonitor
+from scenarios.checkpoint import save_checkpoint, load_checkpoint, restore_rng
+from scenarios.surrogate import FitnessSurrogate
+from scenarios.resultsink import ResultSink
+
+from scenarios.fitset import COLORADO_ACTUAL, observed_series
+from utils.randomstreams import RandomStreams
 
 RUNCOUNT = 1001
+# A warm-started refit begins close to the answer, so it gets a short run that stops once it settles
+WARM_RUNCOUNT = 150
+WARM_PATIENCE = 25
 DATEFORMAT = "%Y-%m-%d"
 MINDATE = datetime(2020, 2, 14)
 MAXDATE = datetime(2020, 3, 3)
+SEEDFILE = 'gaseed.json'
 
-def random_r0():
-	return random.random() * 5.0
-
-def random_start_date():
-	datebredth = (MAXDATE - MINDATE).days
-	date_offset = int(math.floor(random.random() * datebredth))
-	return MINDATE + timedelta(date_offset)
-
-def create_random_scenario():
-	with open('gaseed.json') as fp:
-		newparms = json.load(fp)
-#	newparms['initial_r0'] = random_r0()
-	for shift in newparms['r0_shifts']:
-		shift['r0'] = random_r0()
-	newparms['initial_date'] = random_start_date().strftime(DATEFORMAT)
-	return EpiScenario(newparms)
-
-def mutate_r0(this_r0):
-	adjust_max = this_r0 / 5
-	return (random.random() * adjust_max) - (adjust_max/2)
-
-def mutate_scenario(scenario):
-	newparms = json.loads(json.dumps(scenario.parameters))
-
-	newparms['initial_r0'] += mutate_r0(newparms['initial_r0'])
-	for shift in newparms['r0_shifts']:
-		shift['r0'] += mutate_r0( shift['r0'])
-	current_init_dt = datetime.strptime(newparms['initial_date'], DATEFORMAT)
-	adjustment = int((random.random() * 6) - 3)
-	newparms['initial_date'] = (current_init_dt + timedelta(adjustment)).strftime(DATEFORMAT)
-	return EpiScenario(newparms)
-
-def run_scenario(scenario):
-	model = ScenarioDrivenModel(scenario)
-	model.run()
-	model.gather_sums()
-	model.scenario.calculate_fit(ideal)
-	fitlist.append(model.scenario.fitness)
-
-
-def main_threaded():
-	random.seed()
-
-	scenarios = []
-	for itr in range(0, 100):
-		scenarios.append(create_random_scenario())
+# Each generation keeps ELITES, breeds CHILDREN and adds IMMIGRANTS random candidates
+POPULATION = 100
+ELITES = 9
+CHILDREN = 100
+IMMIGRANTS = 10
 
-	ideal = COLORADO_ACTUAL
+def evaluate_scenarios(scenarios, ideal):
+	# Every candidate is stepped together as one (candidates x compartments) array
+	ensemble = EnsembleRunner(scenarios)
+	ensemble.run()
+	ensemble.gather_sums()
+	return ensemble.calculate_fit(ideal)
+
+
+# Worker process side: each worker compiles the genome space once and reuses it for every chunk
+WORKER_SPACES = dict()
+
+def score_chunk(genomes, seedfile, ideal):
+	if seedfile not in WORKER_SPACES:
+		WORKER_SPACES[seedfile] = GenomeSpace(seedfile, MINDATE, MAXDATE)
+	return WORKER_SPACES[seedfile].evaluate(genomes, ideal)
+
+# Splits the population matrix into one chunk per worker so each process runs a single batch and only
+# genomes and fitness values cross the process boundary.  The observations go over already aligned.
+def evaluate_parallel(population, ideal, executor, workers, seedfile=SEEDFILE):
+	chunks = np.array_split(population, min(workers, len(population)))
+	scores = executor.map(partial(score_chunk, seedfile=seedfile, ideal=observed_series(ideal)), chunks)
+	return np.concatenate(list(scores))
+
+# Scores a generation, skipping any genome the fitness cache has already seen.  Returns the fitness
+# array and how many genomes actually had to be simulated.
+def evaluate_generation(space, population, ideal, executor=None, workers=0, fitness_cache=None):
+	fitness = np.full(len(population), np.nan)
+	if fitness_cache is not None:
+		for row, genome in enumerate(population):
+			cached = fitness_cache.get(space.cache_key(genome))
+			if cached is not None:
+				fitness[row] = cached
+
+	pending = np.flatnonzero(np.isnan(fitness))
+	if len(pending) > 0:
+		if executor is not None:
+			fitness[pending] = evaluate_parallel(population[pending], ideal, executor, workers)
+		else:
+			fitness[pending] = space.evaluate(population[pending], ideal)
+		if fitness_cache is not None:
+			for row in pending:
+				fitness_cache.put(space.cache_key(population[row]), float(fitness[row]))
+
+	return fitness, len(pending)
+
+# Keeps the elites, mutates children from the best candidate and adds random immigrants, all as
+# whole-matrix operations.  The population must already be sorted by fitness.
+def breed(space, population, rng, crossover_rate=0.0):
+	parents = np.repeat(population[:1], CHILDREN, axis=0)
+	if crossover_rate > 0:
+		mates = population[rng.integers(0, ELITES, CHILDREN)]
+		crossed = rng.random(CHILDREN) < crossover_rate
+		parents[crossed] = space.crossover(parents[crossed], mates[crossed], rng)
+	children = space.mutate(parents, rng)
+	return np.vstack([population[:ELITES], children, space.random_population(IMMIGRANTS, rng)])
 
-	print(f"Scenario {scenarios[0]}")
-	for iteration_counter in range(0, RUNCOUNT):
-		print(f"Running itr {iteration_counter}")
-		fitlist = []
-		for scen in scenarios:
-			model = ScenarioDrivenModel(scen)
-			model.run()
-			model.gather_sums()
-			model.scenario.calculate_fit(ideal)
-			fitlist.append(model.scenario.fitness)
-		print(f"fitlist: {fitlist}")
-
-#		print(f"First few = {scenarios[0].serial}:{scenarios[0].fitness},{scenarios[1].serial}:{scenarios[1].fitness},{scenarios[2].serial}:{scenarios[2].fitness}")
-		scenarios = sorted(scenarios, key=attrgetter('fitness'))
-#		print(f"reordered few = {scenarios[0].serial}:{scenarios[0].fitness},{scenarios[1].serial}:{scenarios[1].fitness},{scenarios[2].serial}:{scenarios[2].fitness}")
-		if iteration_counter % 100 == 0:
-			for itr2 in range(0, 10):
-				scenarios[itr2].save_results(iteration_counter + itr2)
-		new_scenarios = scenarios[:9]
-		for itr2 in range(0, 10):
-			this_scen = new_scenarios[itr2]
-			# Add nine motations for each best
-			for _ in range(0, 10):
-				new_scenarios.append(mutate_scenario(new_scenarios[0]))
-		for itr2 in range(0, 10):
-			new_scenarios.append(create_random_scenario())
-		print(f"scen 50: {new_scenarios[50].initial_date} {new_scenarios[50].r0_values}")
-		scenarios = new_scenarios
 
+# The previous run's last scored generation, best first, carried over to the current seed.  Its elites
+# start the new population as they are and the rest is filled with mutations of them.  When fewer than
+# ELITES candidates scored, random ones take the empty elite places.
+def warm_population(space, checkpoint, rng):
+	order = np.argsort(checkpoint['fitness'], kind='stable')
+	ranked = checkpoint['parents'][order][np.isfinite(checkpoint['fitness'][order])]
+	if len(ranked) == 0:
+		raise ValueError("Warm start checkpoint has no candidate with a finite fitness to start from")
+	ranked = space.extend(ranked[:POPULATION], checkpoint['shift_dates'], rng)
+	parents = ranked[np.arange(POPULATION - ELITES) % len(ranked)]
+	population = [ranked[:ELITES], space.mutate(parents, rng)]
+	if len(ranked) < ELITES:
+		population.append(space.random_population(ELITES - len(ranked), rng))
+	return np.vstack(population)
 
 
+def parse_args():
+	parser = argparse.ArgumentParser(description="Fit r0 schedules to actual data with a genetic algorithm")
+	parser.add_argument('--workers', type=int, default=0, metavar='N',
+	                    help="Score each generation across N worker processes")
+	parser.add_argument('--fitness-cache', default=None, metavar='PATH',
+	                    help="Keep scored parameters in PATH so later runs can skip them")
+	parser.add_argument('--fitness-cache-size', type=int, default=100000, metavar='N',
+	                    help="Most scored parameter sets to remember, 0 disables the fitness cache")
+	parser.add_argument('--crossover', type=float, default=0.0, metavar='RATE',
+	                    help="Portion of children bred by crossing the best candidate with another elite")
+	parser.add_argument('--init', choices=SAMPLERS, default='lhs',
+	                    help="How the initial population and each generation's immigrants are drawn")
+	parser.add_argument('--generations', type=int, default=None, metavar='N',
+	                    help=f"Most generations to run, {RUNCOUNT} or {WARM_RUNCOUNT} with --warm-start")
+	parser.add_argument('--patience', type=int, default=None, metavar='N',
+	                    help="Stop once neither the best nor the median fitness has improved for N generations")
+	parser.add_argument('--min-delta', type=float, default=0.0, metavar='D',
+	                    help="Smallest fitness drop that counts as an improvement")
+	parser.add_argument('--max-seconds', type=float, default=None, metavar='S',
+	                    help="Stop after the generation that passes S seconds of wall clock")
+	parser.add_argument('--target', type=float, default=None, metavar='F',
+	                    help="Stop once the best fitness reaches F")
+	parser.add_argument('--history', default=None, metavar='PATH',
+	                    help="Append each generation's summary record to PATH as JSON lines")
+	parser.add_argument('--checkpoint', default=None, metavar='PATH',
+	                    help="Checkpoint the population, RNG and convergence state to PATH")
+	parser.add_argument('--checkpoint-every', type=int, default=10, metavar='N',
+	                    help="Generations between checkpoints")
+	parser.add_argument('--resume', action='store_true',
+	                    help="Carry on from the --checkpoint file when it exists")
+	parser.add_argument('--warm-start', default=None, metavar='PATH',
+	                    help="Seed the population from an earlier run's checkpoint, extending it to new r0 shifts")
+	parser.add_argument('--surrogate', type=float, default=0.0, metavar='FRACTION',
+	                    help="Screen each generation with an emulator and only simulate this fraction of the non-elites")
+	parser.add_argument('--results', choices=['json', 'npz'], default='json',
+	                    help="Write best_fit results as plain JSON, or as npz series with a JSON manifest")
+	parser.add_argument('--seed', type=int, default=None, metavar='N',
+	                    help="Seed every random stream in the run, the same seed repeats the run exactly")
+	args = parser.parse_args()
+	if not 0.0 <= args.surrogate <= 1.0:
+		parser.error("--surrogate takes a fraction between 0 and 1")
+	if args.resume and args.checkpoint is None:
+		parser.error("--resume needs a --checkpoint file")
+	if args.generations is None:
+		args.generations = WARM_RUNCOUNT if args.warm_start is not None else RUNCOUNT
+	if args.patience is None and args.warm_start is not None:
+		args.patience = WARM_PATIENCE
+	return args
+
 
 def main():
-	random.seed()
+	args = parse_args()
+	streams = RandomStreams(args.seed)
+	rng = streams.generator('main')
+	print(f"Seed {streams.seed}")
+
+	# best_fit files are written in the background so a generation never waits on the disk
+	sink = ResultSink(binary=args.results == 'npz')
+	sink.start()
+
+	executor = None
+	if args.workers > 0:
+		executor = ProcessPoolExecutor(max_workers=args.workers)
 
-	scenarios = []
-	for itr in range(0, 100):
-		scenarios.append(create_random_scenario())
+	space = GenomeSpace(SEEDFILE, MINDATE, MAXDATE, args.init)
 
 	ideal = COLORADO_ACTUAL
 
-	print(f"Scenario {scenarios[0]}")
-	for iteration_counter in range(0, RUNCOUNT):
-		print(f"Running itr {iteration_counter}")
-		fitlist = []
-		for scen in scenarios:
-			model = ScenarioDrivenModel(scen)
-			model.run()
-			model.gather_sums()
-			model.scenario.calculate_fit(ideal)
-			fitlist.append(model.scenario.fitness)
-		print(f"fitlist: {fitlist}")
-
-#		print(f"First few = {scenarios[0].serial}:{scenarios[0].fitness},{scenarios[1].serial}:{scenarios[1].fitness},{scenarios[2].serial}:{scenarios[2].fitness}")
-		scenarios = sorted(scenarios, key=attrgetter('fitness'))
-#		print(f"reordered few = {scenarios[0].serial}:{scenarios[0].fitness},{scenarios[1].serial}:{scenarios[1].fitness},{scenarios[2].serial}:{scenarios[2].fitness}")
-		if iteration_counter % 100 == 0:
-			for itr2 in range(0, 10):
-				scenarios[itr2].save_results(iteration_counter + itr2)
-		new_scenarios = scenarios[:9]
-		for itr2 in range(0, 10):
-			this_scen = new_scenarios[itr2]
-			# Add nine motations for each best
-			for _ in range(0, 10):
-				new_scenarios.append(mutate_scenario(new_scenarios[0]))
-		for itr2 in range(0, 10):
-			new_scenarios.append(create_random_scenario())
-		print(f"scen 50: {new_scenarios[50].initial_date} {new_scenarios[50].r0_values}")
-		scenarios = new_scenarios
+	fitness_cache = None
+	if args.fitness_cache_size > 0:
+		fitness_cache = FitnessCache(ideal, args.fitness_cache_size, args.fitness_cache)
+
+	bounds = np.array(space.bounds())
+	monitor = ConvergenceMonitor(bounds[:, 1] - bounds[:, 0], args.patience, args.max_seconds, args.target,
+	                             args.min_delta, args.history)
+
+	surrogate = None
+	if args.surrogate > 0:
+		surrogate = FitnessSurrogate(bounds)
+
+	shift_strings = [shiftdate.strftime(DATEFORMAT) for shiftdate in space.shift_dates]
+	first_generation = 0
+	if args.resume and os.path.isfile(args.checkpoint):
+		checkpoint = load_checkpoint(args.checkpoint)
+		if checkpoint['base_key'] != space.base_key or checkpoint['population'].shape[1] != space.width:
+			raise ValueError(f"Checkpoint {args.checkpoint} was written for a different seed scenario")
+		first_generation = checkpoint['generation']
+		population = checkpoint['population']
+		rng = restore_rng(checkpoint['rng_state'], checkpoint['rng_seed'])
+		monitor.restore(checkpoint['monitor_state'])
+		if surrogate is not None:
+			if checkpoint['surrogate_state'] is None:
+				raise ValueError(f"Checkpoint {args.checkpoint} was written without --surrogate")
+			surrogate.restore(checkpoint['surrogate_state'])
+		print(f"Resuming from {args.checkpoint} at itr {first_generation}")
+	elif args.warm_start is not None:
+		population = warm_population(space, load_checkpoint(args.warm_start), rng)
+		print(f"Warm starting from {args.warm_start}")
+	else:
+		population = space.random_population(POPULATION, rng)
+
+	print(f"Genome {population[0]}")
+	try:
+		for iteration_counter in range(first_generation, args.generations):
+			print(f"Running itr {iteration_counter}")
+			selected = np.ones(len(population), dtype=bool)
+			if surrogate is not None and surrogate.ready():
+				keep = int(round(args.surrogate * (len(population) - ELITES)))
+				selected = surrogate.screen(population, keep, range(0, ELITES))
+			# Candidates the surrogate screened out are never simulated and drop to the bottom of the ranking
+			fitness = np.full(len(population), np.inf)
+			fitness[selected], evaluations = evaluate_generation(space, population[selected], ideal, executor,
+			                                                     args.workers, fitness_cache)
+			print(f"fitlist: {fitness.tolist()}")
+			if surrogate is not None:
+				accuracy = surrogate.score(fitness)
+				surrogate.add(population[selected], fitness[selected])
+				if accuracy is not None:
+					print(f"surrogate: skipped {int((~selected).sum())} candidates, "
+					      f"{accuracy['relative_error']:.1%} mean error, rank correlation {accuracy['rank_correlation']:.3f}")
+			summary = monitor.record(iteration_counter, population, fitness, evaluations)
+			print(f"generation {iteration_counter}: best {summary['best']:.6f}, median {summary['median']:.6f}, "
+			      f"diversity {summary['diversity']:.4f}, {evaluations} evaluations in {summary['seconds']:.2f}s")
+			if fitness_cache is not None:
+				stats = fitness_cache.report()
+				print(f"fitness cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+
+			order = np.argsort(fitness, kind='stable')
+			population = population[order]
+			fitness = fitness[order]
+			stop_reason = monitor.stop_reason()
+			if stop_reason is not None:
+				print(f"Stopping after itr {iteration_counter}: {stop_reason}")
+			periodic = iteration_counter % 100 == 0
+			final = stop_reason is not None or iteration_counter == args.generations - 1
+			if periodic or final:
+				# Genomes carry no curves, the saved results are rebuilt from full scenarios here
+				best = [space.to_scenario(genome) for genome in population[:10]]
+				evaluate_scenarios(best, ideal)
+				for itr2 in range(0, 10):
+					if periodic:
+						best[itr2].save_results(iteration_counter + itr2, sink)
+					# The final top 10 go by rank, so they never land on a periodic snapshot's names
+					if final:
+						best[itr2].save_results(iteration_counter, sink, f"best_fit_final{itr2}")
+				if fitness_cache is not None:
+					fitness_cache.save()
+			surrogate_state = surrogate.state() if surrogate is not None else None
+			if stop_reason is not None:
+				# The final population is kept so the next refit can warm start from it
+				if args.checkpoint is not None:
+					save_checkpoint(args.checkpoint, iteration_counter + 1, population, population, fitness, rng,
+					                monitor.state(), space.base_key, shift_strings, surrogate_state)
+				break
+
+			parents = population
+			population = breed(space, parents, rng, args.crossover)
+			print(f"scen 50: {space.initial_date(population[50])} {population[50][1:].tolist()}")
+			if args.checkpoint is not None and ((iteration_counter + 1) % args.checkpoint_every == 0
+			                                    or iteration_counter == args.generations - 1):
+				save_checkpoint(args.checkpoint, iteration_counter + 1, population, parents, fitness, rng,
+				                monitor.state(), space.base_key, shift_strings, surrogate_state)
+	finally:
+		if executor is not None:
+			executor.shutdown()
+		# Waits for the queued best_fit writes, so an error or Ctrl-C mid-run still leaves them on disk
+		sink.terminate()
+
+	if fitness_cache is not None:
+		fitness_cache.save()
+	if surrogate is not None:
+		stats = surrogate.report()
+		print(f"surrogate saved {stats['skipped']} of {stats['screened']} screened evaluations, "
+		      f"{stats['relative_error']:.1%} mean error, rank correlation {stats['rank_correlation']:.3f}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+import copy
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.stats import qmc
+
+from scenarios.ensemble import BatchedModel, batch_fitness
+from scenarios.fitnesscache import canonical_hash
+from scenarios.fitset import observed_series
+from scenarios.scenario import ScenarioTemplate
+
+DATEFORMAT = "%Y-%m-%d"
+
+START_COLUMN = 0
+INITIAL_R0_COLUMN = 1
+
+# Range every r0 is searched over when the seed doesn't give its own r0_bounds
+R0_BOUNDS = (0.05, 8.0)
+# Random candidates draw shift r0 values below this
+RANDOM_R0_MAX = 5.0
+
+SAMPLERS = ['random', 'lhs', 'sobol']
+
+
+# A GA candidate is a fixed-length row: [start day offset from mindate, initial_r0, r0 for each shift].
+# Everything else in the seed scenario (shift dates, population, age distribution and projections) is
+# parsed and compiled once here and shared by every candidate.
+class GenomeSpace:
+	def __init__(self, seed, mindate, maxdate, sampler='random'):
+		if sampler not in SAMPLERS:
+			raise ValueError(f"Unknown sampler {sampler}, expected one of {SAMPLERS}")
+		self.sampler = sampler
+		if isinstance(seed, str):
+			with open(seed, 'r') as fp:
+				self.base = json.load(fp)
+		else:
+			self.base = copy.deepcopy(seed)
+		self.mindate = mindate
+		self.maxdate = maxdate
+		self.datebreadth = (maxdate - mindate).days
+
+		self.shift_dates = [datetime.strptime(shift['date'], DATEFORMAT) for shift in self.base['r0_shifts']]
+		self.shift_days = np.array([(shiftdate - mindate).days for shiftdate in self.shift_dates])
+		self.width = 2 + len(self.shift_dates)
+
+		# Candidates only differ in their start date and r0 values, everything else is compiled once here
+		self.scenario_template = ScenarioTemplate(self.base)
+		self.template = self.scenario_template.base
+		self.maxdays = self.template.maxdays
+		self.totalpop = float(self.template.totalpop)
+		self.model = BatchedModel(self.template)
+		# The genome's columns only mean something against mindate and the shift dates, so both are part
+		# of the key the fitness cache and checkpoints are matched on
+		base = {key: value for key, value in self.base.items() if key not in ('initial_date', 'initial_r0', 'r0_shifts', 'r0_bounds')}
+		base['mindate'] = mindate.strftime(DATEFORMAT)
+		base['shift_dates'] = [shift['date'] for shift in self.base['r0_shifts']]
+		self.base_key = canonical_hash(base)
+
+	# (low, high) per column: the start can land on any day before maxdate
+	def bounds(self):
+		r0_bounds = tuple(self.base.get('r0_bounds', R0_BOUNDS))
+		return [(0.0, float(self.datebreadth - 1))] + [r0_bounds] * (self.width - 1)
+
+	# Points in the unit cube over the start date and shift r0 columns.  The quasi-random samplers
+	# spread a whole batch evenly instead of drawing each candidate independently.
+	def unit_samples(self, count, rng):
+		dims = self.width - 1
+		if self.sampler == 'lhs':
+			return qmc.LatinHypercube(d=dims, rng=rng).random(count)
+		if self.sampler == 'sobol':
+			# Sobol points balance in powers of two, the leading points of the next one are used
+			exponent = max(int(np.ceil(np.log2(count))), 0)
+			return qmc.Sobol(d=dims, rng=rng).random_base2(exponent)[:count]
+		return rng.random((count, dims))
+
+	def random_population(self, count, rng):
+		samples = self.unit_samples(count, rng)
+		population = np.empty((count, self.width))
+		population[:, START_COLUMN] = np.floor(samples[:, 0] * self.datebreadth)
+		population[:, INITIAL_R0_COLUMN] = self.base['initial_r0']
+		population[:, INITIAL_R0_COLUMN + 1:] = samples[:, 1:] * RANDOM_R0_MAX
+		return population
+
+	# Each r0 moves by up to a tenth of itself either way and the start date by up to two days
+	def mutate(self, parents, rng):
+		children = np.array(parents, dtype=float)
+		r0_values = children[:, INITIAL_R0_COLUMN:]
+		adjust_max = r0_values / 5
+		children[:, INITIAL_R0_COLUMN:] = r0_values + rng.random(r0_values.shape) * adjust_max - adjust_max / 2
+		children[:, START_COLUMN] += np.trunc(rng.random(len(children)) * 6 - 3)
+		return children
+
+	# Uniform crossover, each gene comes from either parent with even odds
+	def crossover(self, parents_a, parents_b, rng):
+		mask = rng.random(parents_a.shape) < 0.5
+		return np.where(mask, parents_a, parents_b)
+
+	def schedules(self, population):
+		starts = population[:, START_COLUMN].astype(int)
+		date_offsets = np.empty((len(population), self.width - 1), dtype=int)
+		date_offsets[:, :-1] = self.shift_days[np.newaxis, :] - starts[:, np.newaxis]
+		date_offsets[:, -1] = self.maxdays
+		return date_offsets, population[:, INITIAL_R0_COLUMN:]
+
+	def evaluate(self, population, ideal):
+		population = np.atleast_2d(population)
+		observed = observed_series(ideal)
+		date_offsets, r0_values = self.schedules(population)
+		history = self.model.run(date_offsets, r0_values, self.model.initial_states(len(population)), self.totalpop)
+		observed_offsets = (observed.start - self.mindate).days - population[:, START_COLUMN].astype(int)
+		return batch_fitness(self.model.total_hosp(history), self.model.total_deceased(history),
+		                     date_offsets.max(axis=1), r0_values, observed, observed_offsets)
+
+	# Carries genomes from an earlier seed over to this one.  Shift dates both seeds share keep their
+	# r0, a newly added shift starts from the r0 in force before it, jittered so the population
+	# doesn't collapse onto one value, and shifts this seed dropped are discarded.
+	def extend(self, genomes, shift_dates, rng, jitter=0.05):
+		genomes = np.atleast_2d(genomes)
+		previous = [datetime.strptime(shiftdate, DATEFORMAT) for shiftdate in shift_dates]
+		extended = np.empty((len(genomes), self.width))
+		extended[:, :INITIAL_R0_COLUMN + 1] = genomes[:, :INITIAL_R0_COLUMN + 1]
+		for itr, shiftdate in enumerate(self.shift_dates):
+			column = INITIAL_R0_COLUMN + 1 + itr
+			if shiftdate in previous:
+				extended[:, column] = genomes[:, INITIAL_R0_COLUMN + 1 + previous.index(shiftdate)]
+			else:
+				earlier = [pos for pos, olddate in enumerate(previous) if olddate < shiftdate]
+				source = INITIAL_R0_COLUMN + 1 + earlier[-1] if earlier else INITIAL_R0_COLUMN
+				extended[:, column] = genomes[:, source] * (1 + jitter * rng.standard_normal(len(genomes)))
+		return extended
+
+	def cache_key(self, genome):
+		return [self.base_key, [float(gene) for gene in genome]]
+
+	def initial_date(self, genome):
+		return self.mindate + timedelta(int(genome[START_COLUMN]))
+
+	def to_parameters(self, genome):
+		parameters = copy.deepcopy(self.base)
+		parameters['initial_date'] = self.initial_date(genome).strftime(DATEFORMAT)
+		parameters['initial_r0'] = float(genome[INITIAL_R0_COLUMN])
+		for itr, shift in enumerate(parameters['r0_shifts']):
+			shift['r0'] = float(genome[INITIAL_R0_COLUMN + 1 + itr])
+		return parameters
+
+	def to_scenario(self, genome):
+		return self.scenario_template.instance(self.initial_date(genome), float(genome[INITIAL_R0_COLUMN]),
+		                                       genome[INITIAL_R0_COLUMN + 1:].tolist())
+
+	def from_scenario(self, scenario):
+		genome = np.empty(self.width)
+		genome[START_COLUMN] = (scenario.initial_date - self.mindate).days
+		genome[INITIAL_R0_COLUMN:] = scenario.r0_values
+		return genome
@@ -0,0 +1,160 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.optimize import minimize
+
+from models.basic_math import calc_infected
+from scenarios.ensemble import batch_fitness
+from scenarios.fitset import COLORADO_ACTUAL, observed_series
+from scenarios.genome import GenomeSpace, START_COLUMN, INITIAL_R0_COLUMN
+from scenarios.geneticfitting import SEEDFILE, MINDATE, MAXDATE, evaluate_scenarios
+
+
+# Steps one candidate through the batched model's compiled graph while carrying d state / d r0_k for
+# every r0 in its schedule.  The transition matrix is linear, so each sensitivity row follows the
+# state's own step, plus the derivative of the new infections moving from susceptible to incubating:
+#     dni = dbeta * I * S / N + beta / N * (I * dS + S * dI)
+class SensitivityModel:
+	def __init__(self, space, ideal):
+		self.space = space
+		self.model = space.model
+		self.observed = observed_series(ideal)
+		self.evaluations = 0
+
+		self.present = ~np.isnan(self.observed['hospitalized'])
+		self.actual_hosp = self.observed['hospitalized'][self.present]
+		self.actual_dead = self.observed['deceased'][self.present]
+		self.hosp_avg = np.sum(self.actual_hosp) / len(self.actual_hosp)
+		self.dead_avg = np.sum(self.actual_dead) / len(self.actual_dead)
+
+	# Returns the (days + 1, compartments) history and the (days + 1, r0 values, compartments) sensitivities
+	def run(self, genome):
+		model = self.model
+		date_offsets, r0_values = self.space.schedules(genome[np.newaxis, :])
+		date_offsets = date_offsets[0]
+		r0_values = r0_values[0]
+		days = int(date_offsets.max())
+		current = np.argmax(date_offsets[:, np.newaxis] > np.arange(days)[np.newaxis, :], axis=0)
+		betas = r0_values[current] / model.period
+		population = self.space.totalpop
+
+		history = np.empty((days + 1, model.engine.size))
+		sensitivity = np.zeros((days + 1, len(r0_values), model.engine.size))
+		history[0] = model.initial_states(1)[0]
+		for day in range(0, days):
+			state = history[day]
+			susceptible = state[model.pos_susceptible]
+			infectious = state[model.pos_infectious]
+			new_infections = calc_infected(population, betas[day], susceptible, infectious)
+
+			dbeta = np.zeros(len(r0_values))
+			dbeta[current[day]] = 1.0 / model.period
+			d_susceptible = sensitivity[day, :, model.pos_susceptible]
+			d_infectious = sensitivity[day, :, model.pos_infectious]
+			d_infections = (dbeta * infectious * susceptible / population
+			                + betas[day] / population * (infectious * d_susceptible + susceptible * d_infectious))
+
+			history[day + 1] = state @ model.transition_t
+			history[day + 1, model.pos_susceptible] -= new_infections
+			history[day + 1, model.pos_incubating] += new_infections
+			sensitivity[day + 1] = sensitivity[day] @ model.transition_t
+			sensitivity[day + 1, :, model.pos_susceptible] -= d_infections
+			sensitivity[day + 1, :, model.pos_incubating] += d_infections
+		return history, sensitivity
+
+	# calculate_fit's objective for one genome and its exact gradient with respect to the r0 values
+	def objective(self, genome):
+		self.evaluations += 1
+		model = self.model
+		history, sensitivity = self.run(genome)
+		r0_values = genome[INITIAL_R0_COLUMN:]
+		observed_offset = (self.observed.start - self.space.mindate).days - int(genome[START_COLUMN])
+
+		fitness = batch_fitness(model.total_hosp(history[:, np.newaxis, :]),
+		                        model.total_deceased(history[:, np.newaxis, :]),
+		                        np.array([len(history) - 1]), r0_values[np.newaxis, :],
+		                        self.observed, np.array([observed_offset]))[0]
+		if not np.isfinite(fitness):
+			return fitness, np.zeros(len(r0_values))
+
+		index = np.arange(self.observed.days)[self.present] + observed_offset
+		hosp_residual = history[index + 1, model.pos_diagnosed] - self.actual_hosp
+		dead_residual = history[index][:, model.pos_deceased].sum(axis=1) - self.actual_dead
+		d_hosp = sensitivity[index + 1, :, model.pos_diagnosed]
+		d_dead = sensitivity[index][:, :, model.pos_deceased].sum(axis=2)
+
+		gradient = np.zeros(len(r0_values))
+		hosp_norm = np.sqrt(np.sum(hosp_residual ** 2))
+		if hosp_norm > 0:
+			gradient += hosp_residual @ d_hosp / (hosp_norm * self.hosp_avg)
+		dead_norm = np.sqrt(np.sum(dead_residual ** 2))
+		if dead_norm > 0:
+			gradient += dead_residual @ d_dead / (dead_norm * self.dead_avg)
+
+		# Roughness term, each r0 appears against its predecessor and its successor
+		previous = np.concatenate([[3.0], r0_values[:-1]])
+		difference = previous - r0_values
+		roughness = np.sqrt(np.sum(difference ** 2))
+		if roughness > 0:
+			rough_gradient = -difference
+			rough_gradient[:-1] += difference[1:]
+			gradient += rough_gradient / (roughness * 3)
+		return fitness, gradient
+
+
+# The start date is discrete, so each candidate start day gets its own bounded quasi-Newton fit of the
+# r0 values, starting from the seed schedule
+def fit_start_day(sensitivity, start_day, r0_values, maxiter):
+	r0_bounds = sensitivity.space.bounds()[INITIAL_R0_COLUMN:]
+	genome = np.concatenate([[start_day], r0_values])
+
+	def objective(r0s):
+		genome[INITIAL_R0_COLUMN:] = r0s
+		return sensitivity.objective(genome)
+
+	result = minimize(objective, r0_values, jac=True, method='L-BFGS-B',
+	                  bounds=r0_bounds, options={'maxiter': maxiter})
+	return np.concatenate([[start_day], result.x]), float(result.fun)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Fit r0 schedules to actual data with gradient-based calibration")
+	parser.add_argument('--maxiter', type=int, default=200, metavar='N',
+	                    help="Most L-BFGS-B iterations for each start date")
+	parser.add_argument('--save', type=int, default=10, metavar='N',
+	                    help="Write the best N start dates to best_fit0.json onwards")
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	ideal = COLORADO_ACTUAL
+	space = GenomeSpace(SEEDFILE, MINDATE, MAXDATE)
+	sensitivity = SensitivityModel(space, ideal)
+	seed = space.from_scenario(space.template)[INITIAL_R0_COLUMN:]
+
+	# Start dates the run can't cover the observations from score inf whatever the r0 values are
+	candidates = np.tile(np.concatenate([[0], seed]), (space.datebreadth, 1))
+	candidates[:, START_COLUMN] = np.arange(space.datebreadth)
+	start_days = candidates[np.isfinite(space.evaluate(candidates, ideal)), START_COLUMN]
+
+	started = time.time()
+	fitted = []
+	for start_day in start_days:
+		before = sensitivity.evaluations
+		genome, fitness = fit_start_day(sensitivity, start_day, seed, args.maxiter)
+		print(f"start {space.initial_date(genome).strftime('%Y-%m-%d')}: fitness {fitness:.6f} after "
+		      f"{sensitivity.evaluations - before} evaluations, r0 {genome[INITIAL_R0_COLUMN:].tolist()}")
+		fitted.append((fitness, genome))
+	print(f"{sensitivity.evaluations} evaluations in {time.time() - started:.1f}s")
+
+	fitted.sort(key=lambda pair: pair[0])
+	best = [space.to_scenario(genome) for _, genome in fitted[:args.save]]
+	evaluate_scenarios(best, ideal)
+	for itr, scenario in enumerate(best):
+		scenario.save_results(itr)
+
+
+if __name__ == '__main__':
+	main()
@@ -7,16 +7,17 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 
-from models.basic_math import calc_beta
+from models.basic_math import calc_beta, calc_beta_schedule
 from parts.amortizedmarkov import ProbState
+from parts.compiledmarkov import compile_seir_model
 from parts.hosppaths_byage import PathsByAge
 from parts.constants import *
 
 from scenarios.scenario import EpiScenario
-from scenarios.fitset import FITNESS_SET
+from scenarios.resultsink import write_result
 
 class HospFloorModel:
-	def __init__(self, scenario):
+	def __init__(self, scenario, compiled=False):
 		if isinstance(scenario, str):
 			self.scenario = EpiScenario(scenario)
 		elif isinstance(scenario, EpiScenario):
@@ -43,6 +44,10 @@ class HospFloorModel:
 		for key, value in self.scenario.subgrouprates.items():
 			self.subgroups[key] = PathsByAge(value, name=key)
 
+		self.engine = None
+		if compiled:
+			self.engine = compile_seir_model(self)
+
 		self.fitness = None
 
 	def run(self):
@@ -52,15 +57,27 @@ class HospFloorModel:
 		self.r0 = value
 
 	def run_r0_set(self, date_offsets, r0_values):
+		if self.engine is not None:
+			self.run_compiled(date_offsets, r0_values)
+			return
 		day_counter = 0
 		for itr in range(0, len(date_offsets)):
 			self.set_r0(r0_values[itr])
-			self.beta = calc_beta(self.r0, self.dayspergen)
-			print(f"{self.beta} = {calc_beta(self.r0, self.dayspergen)})")
+			self.beta = calc_beta(self.r0, self.infectious.period)
 			while day_counter < date_offsets[itr]:
 				self.step_day()
 				day_counter += 1
 
+	def run_compiled(self, date_offsets, r0_values):
+		betas = calc_beta_schedule(date_offsets, r0_values, self.infectious.period)
+		self.set_r0(r0_values[-1])
+		self.beta = calc_beta(self.r0, self.infectious.period)
+
+		self.engine.load()
+		self.engine.run(betas)
+		self.engine.writeback()
+		self.total_days += len(betas)
+
 	def step_day(self):
 		new_infections = self.beta * self.susceptible.count * self.infectious.count / self.population
 #		print(f"Day {self.total_days} infections: {new_infections} = {self.beta} * {self.susceptible.count} * {self.infectious.count} / {self.population}")
@@ -144,7 +161,7 @@ class HospFloorModel:
 		self.scenario.fitness = (hosp_hold / hosp_avg) + (dead_hold / dead_avg)
 
 
-	def save_results(self, iteration):
+	def save_results(self, iteration, sink=None):
 		result = dict()
 
 		result['iteration'] = iteration
@@ -161,8 +178,7 @@ class HospFloorModel:
 		result['sum_recovered'] = self.scenario.sum_recovered
 		result['sum_deceased'] = self.scenario.sum_deceased
 
-		with open(f"best_fit{iteration}", "w") as bfi:
-			json.dump(result, bfi)
+		write_result(f"best_fit{iteration}", result, sink)
 
 	def actual_curves(self):
 		cursor = self.scenario.initial_date
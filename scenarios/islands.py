@@ -0,0 +1,140 @@
+import argparse
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from scenarios.fitset import COLORADO_ACTUAL
+from scenarios.genome import GenomeSpace, SAMPLERS
+from scenarios.geneticfitting import (SEEDFILE, MINDATE, MAXDATE, RUNCOUNT, POPULATION,
+                                      evaluate_generation, evaluate_scenarios, breed)
+from utils.randomstreams import RandomStreams
+
+
+# Each island's outbox in shared memory: its best genomes, with their fitness in the last column.
+# Migration is a ring, island k takes island k - 1's migrants in place of its own worst candidates.
+class MigrationBoard:
+	def __init__(self, islands, migrants, width, name=None):
+		self.shape = (islands, migrants, width + 1)
+		size = int(np.prod(self.shape)) * np.dtype(float).itemsize
+		if name is None:
+			self.memory = shared_memory.SharedMemory(create=True, size=size)
+		else:
+			self.memory = shared_memory.SharedMemory(name=name)
+		self.slots = np.ndarray(self.shape, dtype=float, buffer=self.memory.buf)
+
+	def post(self, island, genomes, fitness):
+		self.slots[island, :, :-1] = genomes
+		self.slots[island, :, -1] = fitness
+
+	def collect(self, island):
+		source = self.slots[(island - 1) % self.shape[0]]
+		return source[:, :-1].copy(), source[:, -1].copy()
+
+	def close(self):
+		del self.slots
+		self.memory.close()
+
+
+# Runs one island in its own process with its own GenomeSpace, batched evaluator and random stream.  Every
+# migrate_every generations all islands post their best, meet at the barrier, take their
+# neighbour's migrants and meet again so no outbox is overwritten before it has been read.
+def run_island(island, seed, board_name, results_name, barrier, args):
+	rng = RandomStreams(seed).generator('island', island)
+	space = GenomeSpace(SEEDFILE, MINDATE, MAXDATE, args.init)
+	board = MigrationBoard(args.islands, args.migrants, space.width, board_name)
+	results = MigrationBoard(args.islands, 1, space.width, results_name)
+	ideal = COLORADO_ACTUAL
+
+	# A failing island breaks the barrier so the others stop instead of waiting on it forever
+	try:
+		population = space.random_population(POPULATION, rng)
+		for generation in range(0, args.generations):
+			fitness, _ = evaluate_generation(space, population, ideal)
+			order = np.argsort(fitness, kind='stable')
+			population = population[order]
+			fitness = fitness[order]
+
+			if (generation + 1) % args.migrate_every == 0:
+				board.post(island, population[:args.migrants], fitness[:args.migrants])
+				barrier.wait()
+				migrants, migrant_fitness = board.collect(island)
+				barrier.wait()
+				population[-args.migrants:] = migrants
+				fitness[-args.migrants:] = migrant_fitness
+				order = np.argsort(fitness, kind='stable')
+				population = population[order]
+				fitness = fitness[order]
+				print(f"island {island} itr {generation}: best {fitness[0]:.6f}, median {np.median(fitness):.6f}")
+
+			if generation == args.generations - 1:
+				results.post(island, population[:1], fitness[:1])
+			else:
+				population = breed(space, population, rng, args.crossover)
+	except Exception:
+		barrier.abort()
+		raise
+	finally:
+		board.close()
+		results.close()
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Fit r0 schedules to actual data with an island-model GA")
+	parser.add_argument('--islands', type=int, default=os.cpu_count(), metavar='K',
+	                    help="Independent subpopulations, each evolving in its own process")
+	parser.add_argument('--generations', type=int, default=RUNCOUNT, metavar='N',
+	                    help="Generations every island runs")
+	parser.add_argument('--migrate-every', type=int, default=10, metavar='M',
+	                    help="Generations between migrations")
+	parser.add_argument('--migrants', type=int, default=3, metavar='N',
+	                    help="Best genomes each island sends to its neighbour")
+	parser.add_argument('--crossover', type=float, default=0.0, metavar='RATE',
+	                    help="Portion of children bred by crossing the best candidate with another elite")
+	parser.add_argument('--init', choices=SAMPLERS, default='lhs',
+	                    help="How each island's initial population and immigrants are drawn")
+	parser.add_argument('--seed', type=int, default=None, metavar='N',
+	                    help="Seed every island's stream, the same seed repeats the run exactly")
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	space = GenomeSpace(SEEDFILE, MINDATE, MAXDATE)
+	board = MigrationBoard(args.islands, args.migrants, space.width)
+	results = MigrationBoard(args.islands, 1, space.width)
+	barrier = multiprocessing.Barrier(args.islands)
+	streams = RandomStreams(args.seed)
+	print(f"Seed {streams.seed}")
+
+	started = time.time()
+	try:
+		workers = [multiprocessing.Process(target=run_island,
+		                                   args=(island, streams.seed, board.memory.name, results.memory.name, barrier, args))
+		           for island in range(0, args.islands)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		if any(worker.exitcode != 0 for worker in workers):
+			raise RuntimeError("An island process failed, see its output above")
+		genomes = results.slots[:, 0, :-1].copy()
+		fitness = results.slots[:, 0, -1].copy()
+	finally:
+		for shared in (board, results):
+			shared.close()
+			shared.memory.unlink()
+	print(f"{args.islands} islands ran {args.generations} generations in {time.time() - started:.1f}s")
+
+	# One best_fit file per island, best island first
+	order = np.argsort(fitness, kind='stable')
+	best = [space.to_scenario(genome) for genome in genomes[order]]
+	evaluate_scenarios(best, COLORADO_ACTUAL)
+	for itr, scenario in enumerate(best):
+		scenario.save_results(itr)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,163 @@
+import argparse
+import math
+import time
+
+import numpy as np
+from scipy.optimize import differential_evolution
+
+from scenarios.fitset import COLORADO_ACTUAL
+from scenarios.genome import GenomeSpace, START_COLUMN
+from scenarios.geneticfitting import SEEDFILE, MINDATE, MAXDATE, evaluate_scenarios
+from utils.randomstreams import RandomStreams
+
+# Stand-in for inf, so a start date that can't cover the observations still ranks and averages cleanly
+INVALID_FITNESS = 1e9
+
+
+# The batched objective every optimizer backend drives: a (candidates x genes) matrix in, one fitness
+# per row out.  Start columns arrive as floats and are floored onto whole days within the bounds.
+class BatchObjective:
+	def __init__(self, space, ideal):
+		self.space = space
+		self.ideal = ideal
+		self.bounds = np.array(space.bounds())
+		self.evaluations = 0
+		self.best_fitness = np.inf
+		self.best_genome = None
+
+	def genomes(self, population):
+		population = np.clip(np.atleast_2d(population), self.bounds[:, 0], self.bounds[:, 1])
+		population[:, START_COLUMN] = np.floor(population[:, START_COLUMN])
+		return population
+
+	def __call__(self, population):
+		population = self.genomes(population)
+		fitness = self.space.evaluate(population, self.ideal)
+		self.evaluations += len(population)
+		best = int(np.argmin(fitness))
+		if fitness[best] < self.best_fitness:
+			self.best_fitness = float(fitness[best])
+			self.best_genome = population[best].copy()
+		return np.where(np.isfinite(fitness), fitness, INVALID_FITNESS)
+
+
+# SciPy's differential evolution, handed the whole population each generation.  Polishing is left off
+# since it would fall back to one finite-difference evaluation at a time.
+def run_differential_evolution(objective, args, rng):
+	def report(intermediate_result):
+		print(f"best {intermediate_result.fun:.6f} after {objective.evaluations} evaluations")
+
+	differential_evolution(lambda population: objective(population.T), objective.bounds,
+	                       vectorized=True, updating='deferred', polish=False, popsize=args.popsize,
+	                       maxiter=args.generations, rng=rng, callback=report)
+
+
+# Minimal CMA-ES (Hansen's tutorial defaults), searching the unit box the bounds map onto.  Samples
+# outside the box are clipped back onto it before scoring and before the update.
+class CMAES:
+	def __init__(self, mean, sigma, popsize, rng):
+		self.rng = rng
+		self.mean = np.array(mean, dtype=float)
+		self.sigma = sigma
+		dims = len(self.mean)
+		self.dims = dims
+		self.popsize = popsize
+		self.parents = popsize // 2
+
+		weights = math.log(self.parents + 0.5) - np.log(np.arange(1, self.parents + 1))
+		self.weights = weights / weights.sum()
+		self.mueff = 1.0 / np.sum(self.weights ** 2)
+
+		self.cc = (4 + self.mueff / dims) / (dims + 4 + 2 * self.mueff / dims)
+		self.cs = (self.mueff + 2) / (dims + self.mueff + 5)
+		self.c1 = 2 / ((dims + 1.3) ** 2 + self.mueff)
+		self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((dims + 2) ** 2 + self.mueff))
+		self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (dims + 1)) - 1) + self.cs
+		self.chi_n = math.sqrt(dims) * (1 - 1 / (4 * dims) + 1 / (21 * dims ** 2))
+
+		self.pc = np.zeros(dims)
+		self.ps = np.zeros(dims)
+		self.basis = np.eye(dims)
+		self.scales = np.ones(dims)
+		self.covariance = np.eye(dims)
+		self.generation = 0
+
+	def ask(self):
+		steps = self.rng.standard_normal((self.popsize, self.dims)) * self.scales @ self.basis.T
+		return np.clip(self.mean + self.sigma * steps, 0.0, 1.0)
+
+	def tell(self, samples, fitness):
+		self.generation += 1
+		selected = samples[np.argsort(fitness, kind='stable')[:self.parents]]
+		steps = (selected - self.mean) / self.sigma
+		mean_step = self.weights @ steps
+		self.mean = self.mean + self.sigma * mean_step
+
+		whitened = self.basis @ ((self.basis.T @ mean_step) / self.scales)
+		self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * whitened
+		ps_norm = np.linalg.norm(self.ps)
+		hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi_n < 1.4 + 2 / (self.dims + 1)
+		self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * mean_step
+
+		rank_one = np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.covariance
+		rank_mu = (steps.T * self.weights) @ steps
+		self.covariance = (1 - self.c1 - self.cmu) * self.covariance + self.c1 * rank_one + self.cmu * rank_mu
+		self.sigma *= math.exp((self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+
+		self.covariance = np.triu(self.covariance) + np.triu(self.covariance, 1).T
+		eigenvalues, self.basis = np.linalg.eigh(self.covariance)
+		self.scales = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+
+def run_cmaes(objective, args, rng):
+	low = objective.bounds[:, 0]
+	span = objective.bounds[:, 1] - low
+	strategy = CMAES(np.full(len(low), 0.5), 0.3, args.popsize, rng)
+	for _ in range(0, args.generations):
+		samples = strategy.ask()
+		fitness = objective(low + samples * span)
+		strategy.tell(samples, fitness)
+		print(f"best {objective.best_fitness:.6f} after {objective.evaluations} evaluations, sigma {strategy.sigma:.4f}")
+		if strategy.sigma < 1e-8:
+			break
+
+
+OPTIMIZERS = {
+	'de': run_differential_evolution,
+	'cmaes': run_cmaes
+}
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Fit r0 schedules to actual data with a batched optimizer")
+	parser.add_argument('--optimizer', choices=sorted(OPTIMIZERS), default='de',
+	                    help="Optimizer backend driving the batched objective")
+	parser.add_argument('--generations', type=int, default=200, metavar='N',
+	                    help="Most generations the optimizer runs")
+	parser.add_argument('--popsize', type=int, default=32, metavar='N',
+	                    help="Population size for cmaes, or the per-dimension multiplier for de")
+	parser.add_argument('--seed', type=int, default=None, metavar='N',
+	                    help="Seed the optimizer's random stream, the same seed repeats the run exactly")
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	streams = RandomStreams(args.seed)
+	rng = streams.generator('main')
+	print(f"Seed {streams.seed}")
+	ideal = COLORADO_ACTUAL
+	space = GenomeSpace(SEEDFILE, MINDATE, MAXDATE)
+	objective = BatchObjective(space, ideal)
+
+	started = time.time()
+	OPTIMIZERS[args.optimizer](objective, args, rng)
+	print(f"{objective.evaluations} evaluations in {time.time() - started:.1f}s")
+
+	best = space.to_scenario(objective.best_genome)
+	evaluate_scenarios([best], ideal)
+	best.save_results(0)
+
+
+if __name__ == '__main__':
+	main()
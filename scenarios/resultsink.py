@@ -0,0 +1,127 @@
+import json
+import numbers
+import os
+import queue
+from threading import Thread
+
+import numpy as np
+
+from parts.querunner import ARNOLD, Terminator
+
+
+# json.dump default for model output, which is full of numpy arrays and scalars
+def json_default(value):
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	if isinstance(value, np.generic):
+		return value.item()
+	raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def is_series(value):
+	if isinstance(value, np.ndarray):
+		return value.ndim > 0 and value.dtype.kind in 'iuf'
+	return (isinstance(value, list) and len(value) > 0
+	        and all(isinstance(item, numbers.Real) and not isinstance(item, bool) for item in value))
+
+
+# Pulls the numeric series out of a (possibly nested) result.  Each one is replaced in the manifest
+# by a reference to its array in the npz, keyed by its dotted path.
+def split_result(result, prefix=''):
+	arrays = dict()
+	manifest = dict()
+	for key, value in result.items():
+		path = f"{prefix}{key}"
+		if isinstance(value, dict) and key != 'scenario':
+			inner_arrays, manifest[key] = split_result(value, f"{path}.")
+			arrays.update(inner_arrays)
+		elif is_series(value):
+			arrays[path] = np.asarray(value, dtype=float)
+			manifest[key] = {'array': path, 'length': len(value)}
+		else:
+			manifest[key] = value
+	return arrays, manifest
+
+
+# Writes results on its own thread so a generation never waits on the disk.  The queue is bounded,
+# when the writer falls that far behind push blocks until it catches up.  With binary set, each
+# result becomes name.npz holding the series plus a small name.json manifest, otherwise name.json
+# holds everything as before.
+class ResultSink(Thread):
+	def __init__(self, directory='.', maxsize=16, binary=True):
+		Thread.__init__(self, daemon=True)
+		self.directory = directory
+		self.binary = binary
+		self.queue = queue.Queue(maxsize=maxsize)
+		self.written = 0
+		self.error = None
+
+	def push(self, name, result):
+		if self.error is not None:
+			raise self.error
+		self.queue.put((name, result))
+
+	def run(self):
+		while True:
+			entity = self.queue.get()
+			try:
+				if isinstance(entity, Terminator):
+					return
+				self.write(*entity)
+				self.written += 1
+			except Exception as err:
+				self.error = err
+			finally:
+				self.queue.task_done()
+
+	# Both files go to temporary names first, so a reader never sees half a result
+	def write(self, name, result):
+		base = os.path.join(self.directory, name)
+		if name.endswith('.json'):
+			base = base[:-len('.json')]
+		manifest = result
+		if self.binary:
+			arrays, manifest = split_result(result)
+			manifest['arrays'] = f"{os.path.basename(base)}.npz"
+			with open(f"{base}.npz.tmp", 'wb') as fp:
+				np.savez(fp, **arrays)
+			os.replace(f"{base}.npz.tmp", f"{base}.npz")
+		with open(f"{base}.json.tmp", 'w') as fp:
+			json.dump(manifest, fp, default=json_default)
+		os.replace(f"{base}.json.tmp", os.path.join(self.directory, name))
+
+	# Waits for everything queued to be written, then stops the thread
+	def terminate(self):
+		self.queue.put(ARNOLD)
+		self.join()
+		if self.error is not None:
+			raise self.error
+
+
+# Hands the result to the sink when there is one, otherwise writes the JSON right away
+def write_result(name, result, sink=None):
+	if sink is not None:
+		sink.push(name, result)
+		return
+	with open(name, 'w') as fp:
+		json.dump(result, fp, default=json_default)
+
+
+# Reads a result back from either layout, putting the series back in place as arrays
+def load_result(path):
+	with open(path, 'r') as fp:
+		manifest = json.load(fp)
+	if 'arrays' not in manifest:
+		return manifest
+	with np.load(os.path.join(os.path.dirname(path), manifest.pop('arrays'))) as stored:
+		arrays = {key: stored[key] for key in stored.files}
+
+	def restore(node):
+		for key, value in node.items():
+			if isinstance(value, dict) and 'array' in value and set(value) == {'array', 'length'}:
+				node[key] = arrays[value['array']]
+			elif isinstance(value, dict) and key != 'scenario':
+				restore(value)
+		return node
+
+	return restore(manifest)
@@ -4,9 +4,12 @@ import math
 import os
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
+import numpy as np
 
 from parts.constants import *
 from parts.agegrouprates import SubgroupRates
+from scenarios.fitset import observed_series
+from scenarios.resultsink import write_result
 
 DATEFORMAT = "%Y-%m-%d"
 ONEDAY = timedelta(1)
@@ -77,6 +80,9 @@ class EpiScenario:
 		}
 
 		# Output result variables
+		self.clear_outputs()
+
+	def clear_outputs(self):
 		self.out_susceptible = None
 		self.out_incubating  = None
 		self.out_infectious  = None
@@ -97,7 +103,8 @@ class EpiScenario:
 		self.fitset = None
 
 
-	def save_results(self, iteration):
+	# Written as best_fit{iteration}.json unless another name is given
+	def save_results(self, iteration, sink=None, name=None):
 		result = dict()
 
 		result['iteration'] = iteration
@@ -112,8 +119,9 @@ class EpiScenario:
 		result['output']['hospitalized'] = self.hospital_door_aggregator
 		result['output']['dead'] = list(self.sum_deceased)
 
-		with open(f"best_fit{iteration}.json", "w") as bfi:
-			json.dump(result, bfi)
+		if name is None:
+			name = f"best_fit{iteration}"
+		write_result(f"{name}.json", result, sink)
 
 
 	def calculate_fit(self, ideal):
@@ -142,34 +150,28 @@ class EpiScenario:
 
 
 		### For fitting Colorado actual
-		hosp_r2 = 0
-		hosp_avg = 0
-		dead_r2 = 0
-		dead_avg = 0
-		fitcount = 0
-
-		for key, value in ideal.items():
-			if key not in self.fitset:
-				raise ValueError(f"It looks like your fitness ideal has dates that exist before your outbreak's initial date.\n"
-				                 f"Ideal value date {key} was not found in the calculated series {self.fitset}\n"
-				                 f"You need to either constrain the initial dates below the first ideal date,"
-				                 f"or remove the earlier data points from your ideal.")
-			fitcount += 1
-#			print(f"comparing {self.fitset[key]['total_hosp']} to {value['hospitalized']}")
-			hosp_off = self.fitset[key]['total_hosp'] - value['hospitalized']
-			hosp_avg += value['hospitalized']
-#			if hosp_off < 0:
-#				hosp_off = -hosp_off
-			hosp_r2 += hosp_off ** 2
-
-			death_off = self.fitset[key]['total_deceased'] - value['deceased']
-#			if death_off < 0:
-#				death_off = -death_off
-			dead_r2 += death_off ** 2
-			dead_avg += value['deceased']
-
-		hosp_avg /= len(ideal)
-		dead_avg /= len(ideal)
+		# Both series share a day index, so the comparison is a slice of the model output
+		observed = observed_series(ideal)
+		actual_hosp = observed['hospitalized']
+		actual_dead = observed['deceased']
+		present = ~np.isnan(actual_hosp)
+		model_hosp = self.fitset.window('total_hosp', observed.start, observed.days)
+		model_dead = self.fitset.window('total_deceased', observed.start, observed.days)
+		if np.isnan(model_hosp[present]).any():
+			missing = observed.start + ONEDAY * int(np.argmax(np.isnan(model_hosp) & present))
+			raise ValueError(f"It looks like your fitness ideal has dates that exist before your outbreak's initial date.\n"
+			                 f"Ideal value date {missing} was not found in the calculated series starting {self.fitset.start}\n"
+			                 f"You need to either constrain the initial dates below the first ideal date,"
+			                 f"or remove the earlier data points from your ideal.")
+		fitcount = int(present.sum())
+
+		hosp_r2 = np.sum((model_hosp[present] - actual_hosp[present]) ** 2)
+		hosp_avg = np.sum(actual_hosp[present])
+		dead_r2 = np.sum((model_dead[present] - actual_dead[present]) ** 2)
+		dead_avg = np.sum(actual_dead[present])
+
+		hosp_avg /= fitcount
+		dead_avg /= fitcount
 
 		hosp_hold = math.sqrt(hosp_r2) / hosp_avg
 		dead_hold = math.sqrt(dead_r2) / dead_avg
@@ -228,3 +230,69 @@ class EpiScenario:
 
 		return plt
 
+
+
+# Parses, validates and compiles a scenario once: population, periods, initial values, shift dates,
+# age distribution and the SubgroupRates for every age group.  Runs built from it only carry the
+# fields a run changes, the initial date and the r0 schedule.
+class ScenarioTemplate:
+	def __init__(self, configfile):
+		self.base = EpiScenario(configfile)
+		self.parameters = self.base.parameters
+		self.shift_dates = [datetime.strptime(shift['date'], DATEFORMAT) for shift in self.parameters['r0_shifts']]
+
+	def instance(self, initial_date=None, initial_r0=None, shift_r0s=None):
+		return TemplatedScenario(self, initial_date, initial_r0, shift_r0s)
+
+
+# An EpiScenario that shares everything static with its template.  parameters is only assembled when
+# something asks for it, and the nested age tables in it are the template's own, so treat them as
+# read-only.
+class TemplatedScenario(EpiScenario):
+	def __init__(self, template, initial_date=None, initial_r0=None, shift_r0s=None):
+		self.fitness = None
+		global SERIAL
+		SERIAL += 1
+		self.serial = SERIAL
+
+		base = template.base
+		self.template = template
+		self.modelname = base.modelname
+		self.totalpop = base.totalpop
+		self.maxdays = base.maxdays
+		self.incubation_period = base.incubation_period
+		self.prediagnosis = base.prediagnosis
+		self.init_susceptible = base.init_susceptible
+		self.init_infected = base.init_infected
+		self.init_infectious = base.init_infectious
+		self.age_distribution = base.age_distribution
+		self.age_projection = base.age_projection
+		self.subgrouprates = base.subgrouprates
+
+		if initial_date is None:
+			self.initial_date = base.initial_date
+		elif isinstance(initial_date, str):
+			self.initial_date = datetime.strptime(initial_date, DATEFORMAT)
+		else:
+			self.initial_date = initial_date
+		if shift_r0s is None:
+			shift_r0s = base.r0_values[1:]
+		elif len(shift_r0s) != len(template.shift_dates):
+			raise ValueError(f"Expected {len(template.shift_dates)} shift r0 values, got {len(shift_r0s)}")
+		self.r0_values = [base.r0_values[0] if initial_r0 is None else initial_r0] + list(shift_r0s)
+		self.r0_date_offsets = [(shiftdate - self.initial_date).days for shiftdate in template.shift_dates]
+		self.r0_date_offsets.append(self.maxdays)
+
+		self._parameters = None
+		self.clear_outputs()
+
+	@property
+	def parameters(self):
+		if self._parameters is None:
+			parameters = dict(self.template.parameters)
+			parameters['initial_date'] = self.initial_date.strftime(DATEFORMAT)
+			parameters['initial_r0'] = self.r0_values[0]
+			parameters['r0_shifts'] = [{'date': shift['date'], 'r0': r0}
+			                           for shift, r0 in zip(self.template.parameters['r0_shifts'], self.r0_values[1:])]
+			self._parameters = parameters
+		return self._parameters
@@ -7,16 +7,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from parts.amortizedmarkov import ProbState
+from parts.compiledmarkov import compile_seir_model
 from parts.hospitalized_agegroup import AgeGroup
+from parts.impulseresponse import ImpulseResponse
 from parts.constants import *
-from models.basic_math import calc_beta, calc_infected
+from models.basic_math import calc_beta, calc_beta_schedule, calc_infected
 
 from scenarios.scenario import EpiScenario
-from scenarios.fitset import COLORADO_ACTUAL
+from scenarios.fitset import COLORADO_ACTUAL, DaySeries, observed_series
+from scenarios.resultsink import write_result
 
 
 class ScenarioDrivenModel:
-	def __init__(self, scenario):
+	def __init__(self, scenario, compiled=False, convolved=False):
 		if isinstance(scenario, str):
 			self.scenario = EpiScenario(scenario)
 		elif isinstance(scenario, EpiScenario):
@@ -43,6 +46,18 @@ class ScenarioDrivenModel:
 		for key, value in self.scenario.subgrouprates.items():
 			self.subgroups[key] = AgeGroup(value, name=key)
 
+		self.engine = None
+		if compiled:
+			self.engine = compile_seir_model(self)
+
+		# In convolved mode only the SEIR chain is stepped, the age groups are filled from the diagnosed series
+		self.responses = None
+		self.diagnosed = []
+		if convolved:
+			self.responses = dict()
+			for key, agegroup in self.subgroups.items():
+				self.responses[key] = ImpulseResponse(agegroup, self.scenario.maxdays)
+
 #		self.fitness = None
 
 	def run(self):
@@ -52,6 +67,9 @@ class ScenarioDrivenModel:
 		self.r0 = value
 
 	def run_r0_set(self, date_offsets, r0_values):
+		if self.engine is not None:
+			self.run_compiled(date_offsets, r0_values)
+			return
 		self.scenario.hospital_door_aggregator = []
 		day_counter = 0
 		for itr in range(0, len(date_offsets)):
@@ -61,6 +79,23 @@ class ScenarioDrivenModel:
 				self.step_day()
 				day_counter += 1
 		self.scenario.hospital_door_aggregator.append(self.scenario.hospital_door_aggregator[-1])
+		if self.responses is not None:
+			self.apply_responses()
+
+	def run_compiled(self, date_offsets, r0_values):
+		betas = calc_beta_schedule(date_offsets, r0_values, self.infectious.period)
+		self.set_r0(r0_values[-1])
+		self.beta = calc_beta(r0_values[-1], self.infectious.period)
+
+		self.engine.load()
+		self.engine.run(betas)
+		self.engine.writeback()
+		self.total_days += len(betas)
+
+		# isolated_holding tallies everyone diagnosed so far, which is what the aggregator tracks
+		diagnosed = self.engine.get_domain(self.isolated_holding)
+		self.scenario.hospital_door_aggregator = diagnosed[1:]
+		self.scenario.hospital_door_aggregator.append(diagnosed[-1])
 
 	def step_day(self):
 		new_infections = calc_infected(self.population, self.beta, self.susceptible.count, self.infectious.count)
@@ -78,21 +113,31 @@ class ScenarioDrivenModel:
 		self.scenario.hospital_door_aggregator.append(diagnagg)
 
 		self.isolated_holding.pending = 0
-		subpop_out = []
-		for key, agegroup in self.subgroups.items():
-			subpop = diagnosed * agegroup.stats.pop_dist
-			subpop_out.append(subpop)
-			agegroup.apply_infections(subpop)
-			agegroup.calculate_redistributions()
+		if self.responses is not None:
+			self.diagnosed.append(diagnosed)
+		else:
+			subpop_out = []
+			for key, agegroup in self.subgroups.items():
+				subpop = diagnosed * agegroup.stats.pop_dist
+				subpop_out.append(subpop)
+				agegroup.apply_infections(subpop)
+				agegroup.calculate_redistributions()
 		self.susceptible.apply_pending()
 		self.incubating.apply_pending()
 		self.infectious.apply_pending()
 
-		for key, agegroup in self.subgroups.items():
-			agegroup.apply_pending()
+		if self.responses is None:
+			for key, agegroup in self.subgroups.items():
+				agegroup.apply_pending()
 
 		self.total_days += 1
 
+	def apply_responses(self):
+		diagnosed = np.array(self.diagnosed)
+		for key, agegroup in self.subgroups.items():
+			self.responses[key].apply(diagnosed * agegroup.stats.pop_dist)
+		self.diagnosed = []
+
 
 	def gather_sums(self):
 		time_increments = len(self.susceptible.domain)
@@ -119,21 +164,14 @@ class ScenarioDrivenModel:
 		self.scenario.sum_hospitalized  = np.add(self.scenario.sum_hospitalized, self.scenario.sum_noncrit)
 		self.scenario.sum_hospitalized  = np.add(self.scenario.sum_hospitalized, self.scenario.sum_icu_vent)
 
-		self.scenario.fitset = dict()
-		cursor = self.scenario.initial_date
-		stoptime = cursor + timedelta(self.total_days)
-		itr = 0
-		while cursor < stoptime:
-			if cursor not in self.scenario.fitset:
-				self.scenario.fitset[cursor] = dict()
-			self.scenario.fitset[cursor]['current_hosp'] = self.scenario.sum_hospitalized[itr]
-			self.scenario.fitset[cursor]['total_hosp'] = self.scenario.hospital_door_aggregator[itr]
-			self.scenario.fitset[cursor]['total_deceased'] = self.scenario.sum_deceased[itr]
-			itr += 1
-			cursor += ONEDAY
+		self.scenario.fitset = DaySeries(self.scenario.initial_date, {
+			'current_hosp': self.scenario.sum_hospitalized[:self.total_days],
+			'total_hosp': self.scenario.hospital_door_aggregator[:self.total_days],
+			'total_deceased': self.scenario.sum_deceased[:self.total_days]
+		})
 
 
-	def save_results(self, iteration):
+	def save_results(self, iteration, sink=None):
 		result = dict()
 
 		result['iteration'] = iteration
@@ -150,25 +188,15 @@ class ScenarioDrivenModel:
 		result['sum_recovered'] = self.scenario.sum_recovered
 		result['sum_deceased'] = self.scenario.sum_deceased
 
-		with open(f"best_fit{iteration}", "w") as bfi:
-			json.dump(result, bfi)
+		write_result(f"best_fit{iteration}", result, sink)
 
+	# Actual data lined up with the model's days, NaN where there is nothing to plot
 	def actual_curves(self):
-		cursor = self.scenario.initial_date
-		finaldate = cursor + timedelta(self.total_days)
-		act_hosp = []
-		act_death = []
-
-		while cursor < finaldate:
-			if cursor in COLORADO_ACTUAL:
-				act_hosp.append(COLORADO_ACTUAL[cursor]['hospitalized'])
-				act_death.append(COLORADO_ACTUAL[cursor]['deceased'])
-			else:
-				act_hosp.append(None)
-				act_death.append(None)
-			cursor += ONEDAY
-		act_death.append(None)
-		act_hosp.append(None)
+		actual = observed_series(COLORADO_ACTUAL)
+		act_hosp = actual.window('hospitalized', self.scenario.initial_date, self.total_days)
+		act_death = actual.window('deceased', self.scenario.initial_date, self.total_days)
+		act_hosp = np.append(act_hosp, np.nan)
+		act_death = np.append(act_death, np.nan)
 		return act_hosp, act_death
 
 	def generate_png(self):
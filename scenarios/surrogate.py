@@ -0,0 +1,94 @@
+import numpy as np
+from scipy.interpolate import RBFInterpolator
+from scipy.stats import spearmanr
+
+
+# A radial-basis emulator of log fitness over genomes, trained on every candidate that has been
+# simulated.  Once it has seen enough of them it screens a generation, and only the candidates it
+# ranks best are passed on to the real model.  Genomes are scaled to the unit box of the search bounds.
+class FitnessSurrogate:
+	def __init__(self, bounds, min_points=200, max_points=2000, neighbors=64):
+		bounds = np.asarray(bounds, dtype=float)
+		self.low = bounds[:, 0]
+		self.span = bounds[:, 1] - bounds[:, 0]
+		self.min_points = min_points
+		self.max_points = max_points
+		self.neighbors = neighbors
+
+		self.points = np.empty((0, len(bounds)))
+		self.values = np.empty(0)
+		self.emulator = None
+		self.pending = None
+
+		self.screened = 0
+		self.skipped = 0
+		self.errors = []
+		self.correlations = []
+
+	def scale(self, genomes):
+		return (np.atleast_2d(genomes) - self.low) / self.span
+
+	def ready(self):
+		return self.emulator is not None
+
+	# Only the most recent max_points simulated candidates are kept, so the fit follows the search
+	def add(self, genomes, fitness):
+		finite = np.isfinite(fitness)
+		self.points = np.vstack([self.points, self.scale(genomes[finite])])[-self.max_points:]
+		self.values = np.concatenate([self.values, np.log(fitness[finite])])[-self.max_points:]
+		self.fit()
+
+	def fit(self):
+		if len(self.values) >= self.min_points:
+			unique, index = np.unique(self.points, axis=0, return_index=True)
+			# A constant-only polynomial tail, genes the population hasn't varied yet would make a
+			# linear one singular
+			self.emulator = RBFInterpolator(unique, self.values[index], kernel='multiquadric', epsilon=1.0,
+			                                degree=0, smoothing=1e-3, neighbors=min(self.neighbors, len(unique)))
+
+	# The training set is all a checkpoint needs, the same points refit the same emulator
+	def state(self):
+		return {'points': self.points, 'values': self.values}
+
+	def restore(self, state):
+		self.points = np.asarray(state['points'], dtype=float)
+		self.values = np.asarray(state['values'], dtype=float)
+		self.fit()
+
+	def predict(self, genomes):
+		return np.exp(self.emulator(self.scale(genomes)))
+
+	# Marks which candidates to simulate: those in always_keep plus the keep best by prediction
+	def screen(self, genomes, keep, always_keep=()):
+		predicted = self.predict(genomes)
+		selected = np.zeros(len(genomes), dtype=bool)
+		selected[list(always_keep)] = True
+		candidates = np.flatnonzero(~selected)
+		selected[candidates[np.argsort(predicted[candidates], kind='stable')[:keep]]] = True
+		self.pending = (selected & ~np.isin(np.arange(len(genomes)), list(always_keep)), predicted)
+		self.screened += len(candidates)
+		self.skipped += len(candidates) - min(keep, len(candidates))
+		return selected
+
+	# Compares the last screen's predictions with the true fitness of the candidates it let through
+	def score(self, fitness):
+		if self.pending is None:
+			return None
+		selected, predicted = self.pending
+		self.pending = None
+		rows = selected & np.isfinite(fitness)
+		if rows.sum() < 2:
+			return None
+		error = float(np.mean(np.abs(predicted[rows] - fitness[rows]) / fitness[rows]))
+		correlation = float(spearmanr(predicted[rows], fitness[rows]).statistic)
+		self.errors.append(error)
+		self.correlations.append(correlation)
+		return {'relative_error': error, 'rank_correlation': correlation}
+
+	def report(self):
+		return {
+			'screened': self.screened,
+			'skipped': self.skipped,
+			'relative_error': float(np.mean(self.errors)) if self.errors else float('nan'),
+			'rank_correlation': float(np.nanmean(self.correlations)) if self.correlations else float('nan')
+		}
@@ -0,0 +1,198 @@
+import argparse
+import copy
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scenarios.scenario import EpiScenario, ScenarioTemplate
+from scenarios.ensemble import EnsembleRunner, STRUCTURAL_PARAMETERS
+from scenarios.fitset import COLORADO_ACTUAL
+from utils.randomstreams import RandomStreams
+
+# Curves stored for every run, each as a (runs x days) column padded with NaN past a run's last day
+OUTPUT_CURVES = ['susceptible', 'incubating', 'infectious', 'isolated', 'noncrit', 'icu', 'icu_vent',
+                 'hospitalized', 'total_hosp', 'recovered', 'deceased']
+
+
+# Sets a dotted path such as "r0_shifts.2.r0" or "age_projection.80+.p_hospitalized" in a nested
+# parameter set, numeric parts index into lists
+def set_parameter(parameters, path, value):
+	parts = path.split('.')
+	node = parameters
+	for part in parts[:-1]:
+		node = node[int(part)] if isinstance(node, list) else node[part]
+	if isinstance(node, list):
+		node[int(parts[-1])] = value
+	elif parts[-1] not in node:
+		raise KeyError(f"Sweep parameter {path} isn't in the base scenario")
+	else:
+		node[parts[-1]] = value
+
+
+# Turns a sweep spec into one dict of {path: value} per run.
+#   grid:   "parameters" maps each path to a list of values, every combination is run
+#   random: "parameters" maps each path to [low, high], "samples" runs are drawn uniformly
+#   list:   "overrides" is the list of runs itself
+def expand_spec(spec, rng=None):
+	mode = spec.get('mode', 'grid')
+	if mode == 'grid':
+		paths = list(spec['parameters'])
+		return [dict(zip(paths, values)) for values in itertools.product(*(spec['parameters'][path] for path in paths))]
+	if mode == 'random':
+		paths = list(spec['parameters'])
+		bounds = np.array([spec['parameters'][path] for path in paths], dtype=float)
+		draws = bounds[:, 0] + rng.random((spec['samples'], len(paths))) * (bounds[:, 1] - bounds[:, 0])
+		return [dict(zip(paths, row.tolist())) for row in draws]
+	if mode == 'list':
+		return [dict(overrides) for overrides in spec['overrides']]
+	raise ValueError(f"Unknown sweep mode {mode}, expected grid, random or list")
+
+
+def apply_overrides(base, overrides):
+	parameters = copy.deepcopy(base)
+	for path, value in overrides.items():
+		set_parameter(parameters, path, value)
+	return parameters
+
+
+# Runs that agree on every structural parameter share one transition matrix and run as one ensemble
+def structural_groups(parameter_list):
+	groups = dict()
+	for row, parameters in enumerate(parameter_list):
+		key = json.dumps([parameters.get(name) for name in STRUCTURAL_PARAMETERS], sort_keys=True)
+		groups.setdefault(key, []).append(row)
+	return list(groups.values())
+
+
+def fit_or_nan(scenario, ideal):
+	try:
+		scenario.calculate_fit(ideal)
+	except ValueError:
+		return np.nan
+	return scenario.fitness
+
+
+# Overrides a ScenarioTemplate instance can take without recompiling the scenario
+def is_run_field(path):
+	parts = path.split('.')
+	return path in ('initial_date', 'initial_r0') or (len(parts) == 3 and parts[0] == 'r0_shifts' and parts[2] == 'r0')
+
+
+# Runs one structural group through the batched engine and returns its curves as lists per run, along
+# with the ensemble's prefix sharing report.  When only run fields were swept, the scenarios are cheap
+# instances of one compiled template.  Runs that only differ from some shift on share the simulation
+# up to it, so the ensemble simulates each distinct r0 prefix once.
+def run_group(parameter_list, templated=False, ideal=COLORADO_ACTUAL):
+	if templated:
+		template = ScenarioTemplate(parameter_list[0])
+		scenarios = [template.instance(parameters['initial_date'], parameters['initial_r0'],
+		                               [shift['r0'] for shift in parameters['r0_shifts']])
+		             for parameters in parameter_list]
+	else:
+		scenarios = [EpiScenario(parameters) for parameters in parameter_list]
+	ensemble = EnsembleRunner(scenarios, share_prefixes=True)
+	ensemble.run()
+	ensemble.gather_sums()
+	results = []
+	for scenario in scenarios:
+		results.append({
+			'fitness': fit_or_nan(scenario, ideal),
+			'susceptible': scenario.out_susceptible,
+			'incubating': scenario.out_incubating,
+			'infectious': scenario.out_infectious,
+			'isolated': scenario.sum_isolated,
+			'noncrit': scenario.sum_noncrit,
+			'icu': scenario.sum_icu,
+			'icu_vent': scenario.sum_icu_vent,
+			'hospitalized': scenario.sum_hospitalized,
+			'total_hosp': scenario.hospital_door_aggregator,
+			'recovered': scenario.sum_recovered,
+			'deceased': scenario.sum_deceased
+		})
+	return results, ensemble.report()
+
+
+def run_sweep(base, spec, workers=0, rng=None):
+	runs = expand_spec(spec, rng)
+	parameter_list = [apply_overrides(base, overrides) for overrides in runs]
+	groups = structural_groups(parameter_list)
+	batches = [[parameter_list[row] for row in group] for group in groups]
+	templated = [all(is_run_field(path) for path in overrides) for overrides in runs]
+	templated = [all(templated[row] for row in group) for group in groups]
+
+	if workers > 0:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			outputs = list(executor.map(run_group, batches, templated))
+	else:
+		outputs = [run_group(batch, flag) for batch, flag in zip(batches, templated)]
+
+	results = [None] * len(runs)
+	for number, (group, (output, report)) in enumerate(zip(groups, outputs)):
+		print(f"group {number}: {len(group)} runs, {report['shared_segments']} of {report['segments']} r0 segments shared "
+		      f"({report['hit_rate']:.0%}), {report['days_simulated']} days simulated, {report['days_saved']} saved")
+		for row, result in zip(group, output):
+			results[row] = result
+	return runs, results
+
+
+# One column per swept path and per output, all indexed by run number
+def save_sweep(path, base, spec, runs, results):
+	columns = dict()
+	paths = sorted({key for overrides in runs for key in overrides})
+	for key in paths:
+		values = [overrides.get(key) for overrides in runs]
+		if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+			columns[f"coord:{key}"] = np.array(values, dtype=float)
+		else:
+			columns[f"coord:{key}"] = np.array([json.dumps(value) for value in values])
+
+	days = max(len(result['susceptible']) for result in results)
+	for name in OUTPUT_CURVES:
+		curves = np.full((len(results), days), np.nan)
+		for row, result in enumerate(results):
+			curves[row, :len(result[name])] = result[name]
+		columns[name] = curves
+	columns['fitness'] = np.array([result['fitness'] for result in results], dtype=float)
+	columns['run'] = np.arange(len(results))
+	columns['base'] = np.array(json.dumps(base))
+	columns['spec'] = np.array(json.dumps(spec))
+
+	tmpname = f"{path}.tmp"
+	with open(tmpname, 'wb') as fp:
+		np.savez_compressed(fp, **columns)
+	os.replace(tmpname, path)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Run a base scenario under a sweep of parameter overrides")
+	parser.add_argument('scenario', help="Base scenario file")
+	parser.add_argument('spec', help="Sweep spec file, see expand_spec")
+	parser.add_argument('--out', default='sweep.npz', metavar='PATH',
+	                    help="Columnar results file")
+	parser.add_argument('--workers', type=int, default=0, metavar='N',
+	                    help="Run structural groups across N worker processes")
+	parser.add_argument('--seed', type=int, default=None, metavar='N',
+	                    help="Seed for random sweeps")
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	with open(args.scenario, 'r') as fp:
+		base = json.load(fp)
+	with open(args.spec, 'r') as fp:
+		spec = json.load(fp)
+	streams = RandomStreams(args.seed)
+
+	started = time.time()
+	runs, results = run_sweep(base, spec, args.workers, streams.generator('sweep'))
+	save_sweep(args.out, base, spec, runs, results)
+	print(f"{len(runs)} runs in {time.time() - started:.1f}s written to {args.out}")
+
+
+if __name__ == '__main__':
+	main()
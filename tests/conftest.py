@@ -0,0 +1,26 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture
+def seed_parameters():
+	with open(REPO / 'gaseed.json') as fp:
+		return json.load(fp)
+
+
+# Builds seed parameters with another start date and r0 schedule, the way GA candidates differ
+@pytest.fixture
+def candidate(seed_parameters):
+	def make(initial_date, initial_r0, shift_r0s):
+		parameters = copy.deepcopy(seed_parameters)
+		parameters['initial_date'] = initial_date
+		parameters['initial_r0'] = initial_r0
+		for shift, r0 in zip(parameters['r0_shifts'], shift_r0s):
+			shift['r0'] = r0
+		return parameters
+	return make
@@ -0,0 +1,77 @@
+import json
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+from scenarios import geneticfitting
+from scenarios.checkpoint import load_checkpoint
+from tests.conftest import REPO
+
+# Wall clock fields differ from run to run
+TIMINGS = ('seconds', 'elapsed')
+
+
+def run_ga(monkeypatch, directory, generations, *options):
+	monkeypatch.chdir(directory)
+	monkeypatch.setattr(sys, 'argv', ['geneticfitting', '--seed', '1234', '--fitness-cache-size', '0',
+	                                  '--generations', str(generations), '--checkpoint', 'checkpoint.npz',
+	                                  '--checkpoint-every', '3', '--history', 'history.jsonl', *options])
+	geneticfitting.main()
+
+
+def read_history(path):
+	with open(path) as fp:
+		records = [json.loads(line) for line in fp]
+	return [{key: value for key, value in record.items() if key not in TIMINGS} for record in records]
+
+
+@pytest.mark.parametrize('options', [(), ('--surrogate', '0.5')])
+def test_resume_repeats_uninterrupted_run(monkeypatch, tmp_path, options):
+	whole = tmp_path / 'whole'
+	resumed = tmp_path / 'resumed'
+	for directory in (whole, resumed):
+		directory.mkdir()
+		shutil.copy(REPO / 'gaseed.json', directory)
+
+	run_ga(monkeypatch, whole, 6, *options)
+	run_ga(monkeypatch, resumed, 3, *options)
+	run_ga(monkeypatch, resumed, 6, '--resume', *options)
+
+	history = read_history(whole / 'history.jsonl')
+	assert [record['generation'] for record in history] == list(range(0, 6))
+	assert read_history(resumed / 'history.jsonl') == history
+	expected = load_checkpoint(whole / 'checkpoint.npz')
+	actual = load_checkpoint(resumed / 'checkpoint.npz')
+	assert actual['generation'] == expected['generation'] == 6
+	for name in ('population', 'parents', 'fitness'):
+		np.testing.assert_array_equal(actual[name], expected[name], err_msg=name)
+	assert actual['rng_state'] == expected['rng_state']
+
+
+# Moving a shift date changes what the r0 columns mean, so the old checkpoint can't be carried on from
+def test_resume_refuses_moved_shift_date(monkeypatch, tmp_path):
+	shutil.copy(REPO / 'gaseed.json', tmp_path)
+	run_ga(monkeypatch, tmp_path, 3)
+
+	with open(tmp_path / 'gaseed.json') as fp:
+		seed = json.load(fp)
+	seed['r0_shifts'][2]['date'] = '2020-03-25'
+	with open(tmp_path / 'gaseed.json', 'w') as fp:
+		json.dump(seed, fp)
+	with pytest.raises(ValueError, match="different seed scenario"):
+		run_ga(monkeypatch, tmp_path, 6, '--resume')
+
+
+# The final top 10 are written by rank and leave generation 0's best_fit files as they were
+def test_final_results_keep_periodic_snapshots(monkeypatch, tmp_path):
+	shutil.copy(REPO / 'gaseed.json', tmp_path)
+	run_ga(monkeypatch, tmp_path, 3)
+
+	for rank in range(0, 10):
+		with open(tmp_path / f"best_fit{rank}.json") as fp:
+			assert json.load(fp)['iteration'] == rank
+		with open(tmp_path / f"best_fit_final{rank}.json") as fp:
+			assert json.load(fp)['iteration'] == 2
+	assert not (tmp_path / 'best_fit10.json').exists()
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import select
+
+import ingest.models as models
+from ingest.coviddatastore import (DATE_SECTIONS, CaseRecord, CovidDatastore, checkfornull, extract_date, parse_line,
+                                   read_records)
+from tests.conftest import REPO
+
+DATA = REPO / 'ingest' / 'data'
+CASE_FILES = sorted(path.name for path in DATA.glob('*.csv'))
+
+
+# The character by character splitter files were parsed with before the csv reader, kept as the oracle
+def extract_quoted(input):
+	output = []
+	thischar = input.pop(0)
+	while thischar != '"' and len(input):
+		output.append(thischar)
+		thischar = input.pop(0)
+	return "".join(output)
+
+
+def split_cvs_string(input):
+	input = list(input)
+	output = []
+	latest = []
+	while len(input) > 0:
+		onechar = input.pop(0)
+		if onechar == '"':
+			latest = extract_quoted(input)
+			continue
+		if onechar == ',':
+			output.append("".join(latest))
+			latest = []
+			continue
+		latest.append(onechar)
+	output.append("".join(latest).strip())
+	return output
+
+
+def legacy_records(lines):
+	for oneline in lines:
+		if ",Note," in oneline:
+			continue
+		description, attribute, metric, value = split_cvs_string(oneline)[:4]
+		if description == 'description':
+			continue
+		if description in DATE_SECTIONS:
+			attribute = extract_date(attribute)
+		yield CaseRecord(description, attribute, metric, checkfornull(value.strip()))
+
+
+@pytest.mark.parametrize('filename', CASE_FILES)
+def test_csv_reader_matches_legacy_splitter(filename):
+	with open(DATA / filename) as fp:
+		lines = fp.readlines()
+	expected = list(legacy_records(lines))
+	assert list(read_records(iter(lines))) == expected
+	parsed = [parse_line(oneline) for oneline in lines if ",Note," not in oneline]
+	assert [record for record in parsed if record is not None] == expected
+
+
+# Every stored row of every data table, ids left out since they say nothing about the content
+def stored_rows(datastore):
+	contents = dict()
+	for model in models.data_models():
+		table = model.__table__
+		columns = [column for column in table.c if column.name != 'id']
+		with datastore.engine.connect() as connection:
+			contents[table.name] = sorted(connection.execute(select(*columns)).all(), key=repr)
+	return contents
+
+
+def test_reloading_files_stores_no_duplicates(monkeypatch, tmp_path):
+	monkeypatch.chdir(REPO / 'ingest')
+	datastore = CovidDatastore({'ENGINE': 'sqlite', 'DATABASE': tmp_path / 'coviddata.db'})
+	filenames = CASE_FILES[-2:]
+	for filename in filenames:
+		datastore.load(filename)
+	loaded = stored_rows(datastore)
+	assert sum(len(rows) for rows in loaded.values()) > 0
+	assert datastore.loaded_files() == set(filenames)
+
+	for bulk in (True, False):
+		for filename in filenames:
+			datastore.load(filename, bulk=bulk)
+		assert stored_rows(datastore) == loaded
+	assert datastore.loaded_files() == set(filenames)
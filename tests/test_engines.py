@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from models.ageadjustedmodel import AgeAdjustedModel
+from models.sociallydrivenmodel import ExternallyDrivenModel
+from scenarios.hospital_floor_model import HospFloorModel
+from scenarios.scenario import EpiScenario
+from scenarios.scenariodriven import ScenarioDrivenModel
+
+CURVES = ['out_susceptible', 'out_incubating', 'out_infectious', 'sum_isolated', 'sum_noncrit', 'sum_icu',
+          'sum_icu_vent', 'sum_recovered', 'sum_deceased', 'sum_hospitalized', 'hospital_door_aggregator']
+FLOOR_CURVES = ['out_susceptible', 'out_incubating', 'out_infectious', 'sum_isolated', 'sum_floor', 'sum_icu',
+                'sum_vent', 'sum_recovered', 'sum_deceased', 'sum_hospitalized']
+AGE_GROUP_CURVES = ['sum_isolated', 'sum_noncrit', 'sum_icu', 'sum_icu_vent', 'sum_recovered', 'sum_deceased']
+
+SCHEDULES = [
+	None,
+	('2020-02-20', 3.4, [2.1, 1.2, 0.9, 1.5, 0.7, 1.1])
+]
+
+
+def run_model(parameters, modelclass=ScenarioDrivenModel, **options):
+	model = modelclass(EpiScenario(parameters), **options)
+	model.run()
+	model.gather_sums()
+	return model.scenario
+
+
+# Both faster ScenarioDrivenModel engines against the object stepping: the compiled sparse matrix, and
+# the SEIR chain stepped with the age groups filled in by convolution
+@pytest.mark.parametrize('engine', ['compiled', 'convolved'])
+@pytest.mark.parametrize('schedule', SCHEDULES)
+def test_engine_matches_object_stepping(seed_parameters, candidate, schedule, engine):
+	parameters = seed_parameters if schedule is None else candidate(*schedule)
+	stepped = run_model(parameters)
+	fast = run_model(parameters, **{engine: True})
+	for name in CURVES:
+		np.testing.assert_allclose(getattr(fast, name), getattr(stepped, name), rtol=1e-9, atol=1e-6, err_msg=name)
+
+
+@pytest.mark.parametrize('schedule', SCHEDULES)
+def test_hosp_floor_compiled_matches_object_stepping(seed_parameters, candidate, schedule):
+	parameters = seed_parameters if schedule is None else candidate(*schedule)
+	stepped = run_model(parameters, HospFloorModel)
+	compiled = run_model(parameters, HospFloorModel, compiled=True)
+	for name in FLOOR_CURVES:
+		np.testing.assert_allclose(getattr(compiled, name), getattr(stepped, name), rtol=1e-9, atol=1e-6, err_msg=name)
+
+
+# The schedule AgeAdjustedModel's main runs
+def test_age_adjusted_compiled_matches_object_stepping():
+	models = []
+	for compiled in (False, True):
+		model = AgeAdjustedModel(compiled=compiled)
+		model.run_r0_set([29, 30, 31, 33, 36, 159], [3.05, 2.55, 2.3, 1.8, 1.3, 1.5])
+		model.gather_sums()
+		models.append(model)
+
+	stepped, compiled = models
+	np.testing.assert_allclose(compiled.susceptible.domain, stepped.susceptible.domain, rtol=1e-9, atol=1e-6)
+	for name in AGE_GROUP_CURVES:
+		np.testing.assert_allclose(getattr(compiled, name), getattr(stepped, name), rtol=1e-9, atol=1e-6, err_msg=name)
+
+
+# A year of daily admissions per age group, read the way the model reads its input file
+def test_externally_driven_convolved_matches_stepping(tmp_path):
+	days = np.arange(0, 365)
+	wave = 40 * np.exp(-((days - 120) / 35.0) ** 2) + 15 * np.exp(-((days - 280) / 25.0) ** 2)
+	filename = tmp_path / 'admissions.csv'
+	with open(filename, 'w') as fp:
+		fp.write("Date,0-9,10-19,20-29,30-39,40-49,50-59,60-69,70-79,80\n")
+		for day, admitted in zip(days, wave):
+			date = datetime(2020, 3, 1) + timedelta(int(day))
+			fp.write(date.strftime('%Y-%m-%d') + ''.join(f",{admitted * share:.4f}" for share in np.linspace(0.2, 1.8, 9)) + "\n")
+
+	models = []
+	for convolved in (False, True):
+		model = ExternallyDrivenModel()
+		model.load_daily_hospitalized(filename)
+		if convolved:
+			model.run_convolved()
+		else:
+			model.run()
+		model.gather_sums()
+		models.append(model)
+
+	stepped, convolved = models
+	assert convolved.total_days == stepped.total_days == len(days)
+	for name in AGE_GROUP_CURVES:
+		np.testing.assert_allclose(getattr(convolved, name), getattr(stepped, name), rtol=1e-9, atol=1e-6, err_msg=name)
@@ -0,0 +1,55 @@
+import itertools
+
+import numpy as np
+
+from scenarios.ensemble import EnsembleRunner
+from scenarios.fitset import COLORADO_ACTUAL
+from scenarios.scenario import EpiScenario, ScenarioTemplate
+from scenarios.scenariodriven import ScenarioDrivenModel
+
+SCHEDULES = [
+	('2020-02-14', 3.0, [2.8, 1.55, 1.55, 1.35, 1.55, 1.35]),
+	('2020-02-20', 3.4, [2.1, 1.2, 0.9, 1.5, 0.7, 1.1]),
+	('2020-02-27', 2.2, [4.0, 2.5, 1.8, 1.2, 1.0, 0.8])
+]
+
+
+def test_ensemble_matches_individual_models(candidate):
+	ensemble_scenarios = [EpiScenario(candidate(*schedule)) for schedule in SCHEDULES]
+	ensemble = EnsembleRunner(ensemble_scenarios)
+	ensemble.run()
+	ensemble.gather_sums()
+	ensemble_fitness = ensemble.calculate_fit(COLORADO_ACTUAL)
+
+	for schedule, batched, fitness in zip(SCHEDULES, ensemble_scenarios, ensemble_fitness):
+		model = ScenarioDrivenModel(EpiScenario(candidate(*schedule)))
+		model.run()
+		model.gather_sums()
+		model.scenario.calculate_fit(COLORADO_ACTUAL)
+		single = model.scenario
+		for name in ['sum_hospitalized', 'sum_deceased', 'hospital_door_aggregator']:
+			np.testing.assert_allclose(getattr(batched, name), getattr(single, name), rtol=1e-9, atol=1e-6, err_msg=name)
+		assert np.isfinite(fitness)
+		assert np.isclose(fitness, single.fitness, rtol=1e-9)
+
+
+# A sweep over the last two shifts from two start dates, the case shared prefixes are for
+def test_shared_prefixes_match_lockstep(seed_parameters):
+	template = ScenarioTemplate(seed_parameters)
+	early = [shift['r0'] for shift in seed_parameters['r0_shifts']][:4]
+	schedules = list(itertools.product(['2020-02-14', '2020-02-20'], [0.7, 1.1, 1.5], [0.6, 0.9]))
+	runners = []
+	for share_prefixes in (False, True):
+		scenarios = [template.instance(initial_date, None, early + [r0, last]) for initial_date, r0, last in schedules]
+		runner = EnsembleRunner(scenarios, share_prefixes=share_prefixes)
+		runner.run()
+		runner.gather_sums()
+		runners.append(runner)
+
+	lockstep, shared = runners
+	for single, batched in zip(lockstep.scenarios, shared.scenarios):
+		for name in ['out_susceptible', 'sum_hospitalized', 'sum_deceased', 'hospital_door_aggregator']:
+			np.testing.assert_array_equal(getattr(batched, name), getattr(single, name), err_msg=name)
+	report = shared.report()
+	assert report['shared_segments'] > 0
+	assert report['days_simulated'] + report['days_saved'] == lockstep.total_days.sum()
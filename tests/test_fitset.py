@@ -0,0 +1,30 @@
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scenarios import fitset
+from scenarios.fitset import COLORADO_ACTUAL, DaySeries, observed_series
+from scenarios.geneticfitting import MAXDATE, MINDATE, evaluate_parallel
+from scenarios.genome import GenomeSpace
+from tests.conftest import REPO
+
+
+# Fresh copies of the observations, as every unpickled argument in a worker is, mustn't pile up
+def test_aligned_cache_is_bounded():
+	expected = observed_series(COLORADO_ACTUAL)
+	for _ in range(0, 3 * fitset.ALIGNED_MAX):
+		series = observed_series(copy.deepcopy(COLORADO_ACTUAL))
+		np.testing.assert_array_equal(series['hospitalized'], expected['hospitalized'])
+	assert len(fitset.ALIGNED) <= fitset.ALIGNED_MAX
+	assert observed_series(expected) is expected
+	assert isinstance(expected, DaySeries)
+
+
+def test_parallel_scores_match_serial():
+	seedfile = str(REPO / 'gaseed.json')
+	space = GenomeSpace(seedfile, MINDATE, MAXDATE)
+	population = space.random_population(12, np.random.default_rng(5))
+	with ProcessPoolExecutor(max_workers=2) as executor:
+		parallel = evaluate_parallel(population, COLORADO_ACTUAL, executor, 2, seedfile)
+	np.testing.assert_array_equal(parallel, space.evaluate(population, COLORADO_ACTUAL))
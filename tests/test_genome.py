@@ -0,0 +1,25 @@
+import copy
+from datetime import datetime
+
+import numpy as np
+
+from scenarios.genome import GenomeSpace
+
+MINDATE = datetime(2020, 2, 14)
+MAXDATE = datetime(2020, 3, 3)
+
+
+# The same genome means another schedule once a shift date or mindate moves, so its key has to change
+def test_cache_key_covers_shift_dates_and_mindate(seed_parameters):
+	space = GenomeSpace(seed_parameters, MINDATE, MAXDATE)
+	genome = space.random_population(1, np.random.default_rng(0))[0]
+
+	moved = copy.deepcopy(seed_parameters)
+	moved['r0_shifts'][2]['date'] = '2020-03-25'
+	shifted = GenomeSpace(moved, MINDATE, MAXDATE)
+	later = GenomeSpace(seed_parameters, datetime(2020, 2, 15), MAXDATE)
+
+	assert GenomeSpace(seed_parameters, MINDATE, MAXDATE).cache_key(genome) == space.cache_key(genome)
+	for other in (shifted, later):
+		assert other.base_key != space.base_key
+		assert other.cache_key(genome) != space.cache_key(genome)
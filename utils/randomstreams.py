@@ -0,0 +1,27 @@
+import numpy as np
+
+# Every consumer gets its own branch of the run's SeedSequence.  Streams are addressed by name and
+# index rather than by the order they were asked for, so adding a worker or island never shifts the
+# numbers any other stream draws.
+STREAMS = {
+	'main': 0,
+	'island': 1,
+	'worker': 2,
+	'sweep': 3
+}
+
+
+class RandomStreams:
+	def __init__(self, seed=None):
+		self.root = np.random.SeedSequence(seed)
+		# The entropy actually used, printing it lets an unseeded run be repeated
+		self.seed = self.root.entropy
+
+	def sequence(self, name, index=0):
+		return np.random.SeedSequence(self.seed, spawn_key=(STREAMS[name], index))
+
+	def generator(self, name, index=0):
+		return np.random.default_rng(self.sequence(name, index))
+
+	def generators(self, name, count):
+		return [self.generator(name, index) for index in range(0, count)]